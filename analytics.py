@@ -0,0 +1,303 @@
+"""Leave analytics: applications and leave days grouped by department, status,
+application type and month, computed by the database.
+
+A leave counts in the month of its ``from_date`` for all of its days
+(``to_date - from_date + 1``, whole days). Applications without a type,
+status or dates are left out.
+
+With ``ANALYTICS_SUMMARY=true`` every application write also applies its
+delta to the leave_summary table, in the same transaction, and the report
+is a GROUP BY over that (a few rows per department and month) instead of
+over applications. ``python -m analytics rebuild`` recomputes the table,
+needed once after switching it on. The same deltas keep the leave ledger
+(ledger.py) up to date, whatever the setting.
+"""
+
+import asyncio
+import sys
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import Date, Integer, and_, cast, delete, func, insert, literal, select
+from sqlalchemy.dialects.postgresql import UUID
+
+import ledger
+from db import dialect_insert, dialect_name, new_session
+from models import Application, Department, LeaveSummary
+from settings import settings
+
+DIMENSIONS = ("department", "status", "application_type", "month")
+
+# Stands for "no department" in the summary primary key. Not the nil UUID:
+# SQLite would store that all digits hex as a number.
+NO_DEPARTMENT = uuid.UUID(int=(1 << 128) - 1)
+
+SUMMARY_KEY = ("department_id", "month", "status", "application_type")
+
+# Application columns the summary and the ledger depend on.
+CONTRIBUTION = (
+    "department_id",
+    "employee_id",
+    "status",
+    "application_type",
+    "from_date",
+    "to_date",
+)
+
+
+def first_of_month(value):
+    return date(value.year, value.month, 1)
+
+
+def as_day(value):
+    """Dates are TIMESTAMP columns, but a PATCH sets plain ``date`` values."""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def month_start(text):
+    """``YYYY-MM`` query value --> first day of that month."""
+    year, month = text.split("-")
+    return date(int(year), int(month), 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def month_of(db, column):
+    if dialect_name(db) == "postgresql":
+        return cast(func.date_trunc("month", column), Date)
+    return func.date(column, "start of month", type_=Date)
+
+
+def days_of(db):
+    """Whole days of an application, both ends included."""
+    if dialect_name(db) == "postgresql":
+        return cast(Application.to_date, Date) - cast(Application.from_date, Date) + 1
+    return (
+        cast(
+            func.julianday(func.date(Application.to_date))
+            - func.julianday(func.date(Application.from_date)),
+            Integer,
+        )
+        + 1
+    )
+
+
+def counted():
+    return and_(
+        Application.status.is_not(None),
+        Application.application_type.is_not(None),
+        Application.from_date.is_not(None),
+        Application.to_date.is_not(None),
+    )
+
+
+# ****************************** Incremental upkeep ******************************
+
+
+def contribution(application):
+    """What an application (ORM object or row dict) adds to the summary."""
+    if isinstance(application, dict):
+        return {name: application.get(name) for name in CONTRIBUTION}
+    return {name: getattr(application, name) for name in CONTRIBUTION}
+
+
+async def snapshot(db, ids, changed=None):
+    """Contributions of the applications ``ids`` as they are now, taken before
+    and after a write that doesn't have the rows at hand (bulk routes). The
+    rows stay locked until the transaction ends.
+
+    None, and no query, when the write only sets ``changed`` columns that
+    don't contribute; track() then has nothing to do."""
+    if changed is not None and not set(changed) & set(CONTRIBUTION):
+        return None
+    if not ids:
+        return []
+    columns = (getattr(Application, name) for name in CONTRIBUTION)
+    rows = await db.execute(select(*columns).where(Application.id.in_(ids)).with_for_update())
+    return [dict(row._mapping) for row in rows]
+
+
+async def track(db, before, after):
+    """Apply the change from the ``before`` to the ``after`` contributions to
+    the leave ledger and, with ANALYTICS_SUMMARY on, to leave_summary, in the
+    caller's transaction. ``before`` None: snapshot() skipped the write."""
+    if before is None:
+        return
+    await ledger.track(db, before, after)
+    if not settings.analytics_summary:
+        return
+    delta = {}
+    for rows, sign in ((before, -1), (after, 1)):
+        for row in rows:
+            if None in (row["status"], row["application_type"], row["from_date"], row["to_date"]):
+                continue
+            key = (
+                row["department_id"] or NO_DEPARTMENT,
+                first_of_month(row["from_date"]),
+                row["status"],
+                row["application_type"],
+            )
+            days = (as_day(row["to_date"]) - as_day(row["from_date"])).days + 1
+            applications, total = delta.get(key, (0, 0))
+            delta[key] = (applications + sign, total + sign * days)
+
+    # Always the same order, so concurrent writers lock the rows alike.
+    values = [
+        dict(zip(SUMMARY_KEY, key), applications=applications, days=days)
+        for key, (applications, days) in sorted(delta.items(), key=lambda item: str(item[0]))
+        if applications or days
+    ]
+    if not values:
+        return
+    statement = dialect_insert(db, LeaveSummary).values(values)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=SUMMARY_KEY,
+            set_={
+                "applications": LeaveSummary.applications + statement.excluded.applications,
+                "days": LeaveSummary.days + statement.excluded.days,
+            },
+        )
+    )
+
+
+async def rebuild_summary(db):
+    """Recompute leave_summary from the applications."""
+    month = month_of(db, Application.from_date)
+    department = func.coalesce(
+        Application.department_id, literal(NO_DEPARTMENT, UUID(as_uuid=True))
+    )
+    await db.execute(delete(LeaveSummary))
+    await db.execute(
+        insert(LeaveSummary).from_select(
+            [*SUMMARY_KEY, "applications", "days"],
+            select(
+                department,
+                month,
+                Application.status,
+                Application.application_type,
+                func.count(),
+                func.sum(days_of(db)),
+            )
+            .where(counted())
+            .group_by(department, month, Application.status, Application.application_type),
+        )
+    )
+
+
+async def forget_department(db, department_id):
+    """Move the leave_summary rows of the deleted department ``department_id``
+    to NO_DEPARTMENT, where its applications (department_id SET NULL) count
+    now; in the caller's transaction."""
+    if not settings.analytics_summary:
+        return
+    ours = LeaveSummary.department_id == department_id
+    moved = select(
+        literal(NO_DEPARTMENT, UUID(as_uuid=True)),
+        LeaveSummary.month,
+        LeaveSummary.status,
+        LeaveSummary.application_type,
+        LeaveSummary.applications,
+        LeaveSummary.days,
+    ).where(ours)
+    statement = dialect_insert(db, LeaveSummary).from_select(
+        [*SUMMARY_KEY, "applications", "days"], moved
+    )
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=SUMMARY_KEY,
+            set_={
+                "applications": LeaveSummary.applications + statement.excluded.applications,
+                "days": LeaveSummary.days + statement.excluded.days,
+            },
+        )
+    )
+    await db.execute(delete(LeaveSummary).where(ours))
+
+
+# ********************************** Reports **********************************
+
+
+async def leave_report(db, group_by, filters):
+    """Rows of ``group_by`` dimensions with their application and day totals.
+
+    ``filters``: department_id, status, application_type, from_month and
+    to_month (first days of months), all optional.
+    """
+    if settings.analytics_summary:
+        source = LeaveSummary
+        month = LeaveSummary.month
+        applications = func.sum(LeaveSummary.applications)
+        days = func.sum(LeaveSummary.days)
+        query = select().select_from(LeaveSummary)
+        if filters.get("from_month"):
+            query = query.where(month >= filters["from_month"])
+        if filters.get("to_month"):
+            query = query.where(month <= filters["to_month"])
+    else:
+        source = Application
+        month = month_of(db, Application.from_date)
+        applications = func.count()
+        days = func.sum(days_of(db))
+        query = select().select_from(Application).where(counted())
+        # Range on the raw column, ix_applications_from_date can serve it.
+        if filters.get("from_month"):
+            query = query.where(Application.from_date >= filters["from_month"])
+        if filters.get("to_month"):
+            query = query.where(Application.from_date < next_month(filters["to_month"]))
+
+    if filters.get("department_id"):
+        query = query.where(source.department_id == filters["department_id"])
+    for name in ("status", "application_type"):
+        if filters.get(name):
+            query = query.where(getattr(source, name) == filters[name])
+
+    columns = []
+    if "department" in group_by:
+        query = query.outerjoin(Department, Department.id == source.department_id)
+        columns += [source.department_id, Department.name]
+    if "status" in group_by:
+        columns.append(source.status)
+    if "application_type" in group_by:
+        columns.append(source.application_type)
+    if "month" in group_by:
+        columns.append(month.label("month"))
+
+    query = query.add_columns(
+        *columns, applications.label("applications"), days.label("days")
+    ).having(applications > 0)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    report = []
+    for row in await db.execute(query):
+        item = {"applications": row.applications, "days": row.days or 0}
+        if "department" in group_by:
+            department_id = row.department_id
+            item["department_id"] = None if department_id == NO_DEPARTMENT else department_id
+            item["department"] = row.name
+        if "status" in group_by:
+            item["status"] = row.status
+        if "application_type" in group_by:
+            item["application_type"] = row.application_type
+        if "month" in group_by:
+            item["month"] = row.month.strftime("%Y-%m")
+        report.append(item)
+    return report
+
+
+async def rebuild():
+    db = new_session()
+    try:
+        await rebuild_summary(db)
+        await db.commit()
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m analytics rebuild")
+    asyncio.run(rebuild())
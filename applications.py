@@ -0,0 +1,214 @@
+"""Write path of leave / work from home applications.
+
+Work from home rule: two WFH applications of the same department can't
+overlap (``from_date``..``to_date``, both days included), rejected ones
+don't count. The check and the insert are one statement,
+
+    INSERT INTO applications (...)
+    SELECT ..., employees.department_id FROM employees
+    WHERE employees.id = :employee_id
+      AND NOT EXISTS (live WFH of that department overlapping the range)
+    RETURNING ...
+
+served by ix_applications_department_slot. An update moving an application
+onto a WFH slot (type, status or dates) runs the same NOT EXISTS first,
+see wfh_taken(). On Postgres the ex_applications_wfh_overlap exclusion
+constraint backs both up, so two concurrent requests can't both get in
+even under READ COMMITTED.
+
+``department_id`` is the department of the employee: an employee moving
+to another department takes the live applications along, in the same
+transaction as the employee's row (follow_department()), under the same
+rule.
+"""
+
+from datetime import datetime, time
+
+from sqlalchemy import and_, bindparam, exists, insert, or_, select
+
+import analytics
+from models import Application, Application_type, Employee, Status
+from updates import bump
+
+
+WFH_TAKEN = "Work From Home already taken from the same department"
+INVERTED = "to_date is before from_date. "
+DUPLICATE = "Employee already has an application of this type starting that day. "
+NO_EMPLOYEE = "Work From Home applications need an employee. "
+
+# (names in the error message, answer) per constraint, for updates.violation();
+# SQLite names the columns of a unique index, not the index.
+VIOLATIONS = (
+    (("ck_applications_period",), 400, INVERTED),
+    (("ex_applications_wfh_overlap",), 403, WFH_TAKEN),
+    (
+        (
+            "uq_applications_employee_id_type_from_date",
+            "applications.employee_id, applications.application_type, applications.from_date",
+        ),
+        409,
+        DUPLICATE,
+    ),
+)
+
+
+PERIOD = (Application.from_date, Application.to_date)
+
+
+class ApplicationConflict(Exception):
+    """The new application overlaps a WFH of the same department."""
+
+
+class EmployeeNotFound(Exception):
+    pass
+
+
+def as_timestamp(day):
+    """``date`` request values go into the TIMESTAMP columns at midnight."""
+    return datetime.combine(day, time()) if day is not None else None
+
+
+def inverted(row):
+    """``row`` (dict of the columns) ends before it starts."""
+    from_date, to_date = row.get("from_date"), row.get("to_date")
+    return from_date is not None and to_date is not None and to_date < from_date
+
+
+def wfh_overlap(department_id, from_date, to_date):
+    """Live WFH applications of ``department_id`` overlapping the date range."""
+    return and_(
+        Application.department_id == department_id,
+        Application.application_type == Application_type.WFH,
+        Application.status != Status.REJECTED,
+        Application.from_date <= to_date,
+        Application.to_date >= from_date,
+    )
+
+
+def overlaps(first, second):
+    return first["from_date"] <= second["to_date"] and first["to_date"] >= second["from_date"]
+
+
+def is_wfh_slot(row):
+    return (
+        row["application_type"] == Application_type.WFH
+        and row["status"] != Status.REJECTED
+        and row.get("department_id") is not None
+    )
+
+
+async def wfh_taken(db, row, exclude=()):
+    """Whether ``row`` (dict of the columns, as it would be stored) takes a WFH
+    slot another live WFH of its department, but the ``exclude`` ids, holds."""
+    if not is_wfh_slot(row):
+        return False
+    clash = wfh_overlap(row["department_id"], row["from_date"], row["to_date"])
+    return await db.scalar(select(exists().where(clash, Application.id.not_in(exclude))))
+
+
+async def insert_application(db, values):
+    """Insert one application (``values`` from CreateApplicationRequest) with
+    the work from home rule applied, in a single statement."""
+    values = dict(values, from_date=as_timestamp(values["from_date"]))
+    values["to_date"] = as_timestamp(values["to_date"])
+    employee_id = values.pop("employee_id", None)
+    if employee_id is None:
+        # The rule is per department, the employee's: no WFH without one.
+        if values["application_type"] == Application_type.WFH:
+            raise EmployeeNotFound()
+        return await db.scalar(insert(Application).values(**values).returning(Application))
+
+    columns = Application.__table__.c
+    source = select(
+        *(bindparam(name, value, type_=columns[name].type) for name, value in values.items()),
+        Employee.id,
+        Employee.department_id,
+    ).where(Employee.id == employee_id)
+    if values["application_type"] == Application_type.WFH:
+        source = source.where(
+            ~exists().where(
+                wfh_overlap(Employee.department_id, values["from_date"], values["to_date"])
+            )
+        )
+    statement = (
+        insert(Application)
+        .from_select([*values, "employee_id", "department_id"], source)
+        .returning(Application)
+    )
+    application = await db.scalar(statement)
+    if application is None:
+        # Nothing inserted: tell a missing employee from a taken slot.
+        if await db.get(Employee, employee_id) is None:
+            raise EmployeeNotFound()
+        raise ApplicationConflict()
+    return application
+
+
+async def follow_department(db, departments):
+    """Give the live (not rejected) applications of the employees of
+    ``departments`` (employee id --> new department id) that department,
+    with the summary moved along, in the caller's transaction.
+
+    The employees are taken one after the other; one whose WFH would overlap
+    a live WFH of the new department is refused and nothing of theirs is
+    written. Returns the refused employee ids."""
+    if not departments:
+        return set()
+    columns = (getattr(Application, name) for name in analytics.CONTRIBUTION)
+    found = await db.execute(
+        select(Application.id, *columns)
+        .where(
+            Application.employee_id.in_(departments),
+            Application.status.is_distinct_from(Status.REJECTED),
+        )
+        .with_for_update()
+    )
+    stored = {
+        row.id: dict(row._mapping)
+        for row in found
+        if row.department_id != departments[row.employee_id]
+    }
+    moving = {}
+    for row in stored.values():
+        moved = dict(row, department_id=departments[row["employee_id"]])
+        moving.setdefault(row["employee_id"], []).append(moved)
+
+    # Slots as they are now, then as each employee moves.
+    wanted = [row for rows in moving.values() for row in rows if is_wfh_slot(row)]
+    slots = {}
+    if wanted:
+        clash = or_(
+            *(wfh_overlap(row["department_id"], row["from_date"], row["to_date"]) for row in wanted)
+        )
+        taken = await db.execute(
+            select(Application.id, Application.department_id, *PERIOD).where(clash)
+        )
+        for row in taken:
+            slots.setdefault(row.department_id, []).append(dict(row._mapping))
+    refused = set()
+    for employee_id, rows in moving.items():
+        own = {row["id"] for row in rows}
+        held = [slot for slot in slots.get(departments[employee_id], []) if slot["id"] not in own]
+        if any(overlaps(row, slot) for row in rows if is_wfh_slot(row) for slot in held):
+            refused.add(employee_id)
+            continue
+        for department_slots in slots.values():
+            department_slots[:] = [slot for slot in department_slots if slot["id"] not in own]
+        for row in rows:
+            if is_wfh_slot(row):
+                slots.setdefault(row["department_id"], []).append(row)
+
+    moved = [
+        row for employee_id, rows in moving.items() if employee_id not in refused for row in rows
+    ]
+    if moved:
+        await db.execute(
+            bump(Application),
+            [{"id": row["id"], "department_id": row["department_id"]} for row in moved],
+        )
+        await analytics.track(
+            db,
+            [analytics.contribution(stored[row["id"]]) for row in moved],
+            [analytics.contribution(row) for row in moved],
+        )
+    return refused
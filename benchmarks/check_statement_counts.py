@@ -0,0 +1,91 @@
+"""Statements issued per request by the routes with ``?include=``.
+
+Every route is called with two page sizes; the number of statements has to
+be the same for both (no per row lazy load) and match the expected count.
+Exits non zero on a mismatch.
+
+Usage:
+
+    DB_URL=sqlite:///./bench.db python -m benchmarks.check_statement_counts
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault("DB_URL", "sqlite:///./bench.db")
+
+# route --> expected statements per request
+EXPECTED = {
+    "/employee/": 1,
+    "/employee/?include=department": 1,
+    "/employee/?include=applications": 2,
+    "/employee/?include=languages": 2,
+    "/employee/?include=department,applications,languages": 3,
+    "/application/": 1,
+    "/application/?include=employee,department": 1,
+    "/employee/{employee_id}/?include=department,applications,languages": 3,
+    "/application/{application_id}/?include=employee,department": 1,
+}
+
+PAGE_SIZES = (5, 100)
+
+
+async def count_statements(app, counter, employee_id, application_id):
+    import httpx
+
+    counts = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        for route in EXPECTED:
+            path = route.format(employee_id=employee_id, application_id=application_id)
+            for limit in PAGE_SIZES:
+                counter.clear()
+                separator = "&" if "?" in path else "?"
+                response = await client.get(f"{path}{separator}limit={limit}")
+                response.raise_for_status()
+                counts[route, limit] = len(counter)
+    return counts
+
+
+def main():
+    from sqlalchemy import event, select
+
+    from benchmarks.common import quiet_sql, seed
+    from db import async_engin, engin
+    from main import app
+    from models import Application, Employee
+
+    quiet_sql()
+    seed(engin, departments=5, employees=200, applications=1000)
+    with engin.connect() as conn:
+        employee_id = conn.scalar(
+            select(Application.employee_id).where(Application.employee_id.is_not(None)).limit(1)
+        )
+        application_id = conn.scalar(select(Application.id).limit(1))
+        assert conn.scalar(select(Employee.department_id).where(Employee.id == employee_id))
+
+    counter = []
+    for engine in (engin, async_engin):
+        if engine is not None:
+            sync_engine = getattr(engine, "sync_engine", engine)
+            event.listen(sync_engine, "before_cursor_execute", lambda *args: counter.append(1))
+
+    counts = asyncio.run(count_statements(app, counter, employee_id, application_id))
+
+    failures = 0
+    print(f"{'route':<72} " + " ".join(f"{f'limit={n}':>10}" for n in PAGE_SIZES))
+    for route, expected in EXPECTED.items():
+        found = [counts[route, limit] for limit in PAGE_SIZES]
+        ok = all(count == expected for count in found)
+        failures += not ok
+        print(
+            f"{route:<72} "
+            + " ".join(f"{count:>10}" for count in found)
+            + ("" if ok else f"   expected {expected}")
+        )
+    if failures:
+        raise SystemExit(f"{failures} routes issue an unexpected number of statements")
+
+
+if __name__ == "__main__":
+    main()
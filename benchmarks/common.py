@@ -0,0 +1,166 @@
+"""Shared helpers for the benchmark scripts: synthetic data and latency stats."""
+
+import logging
+import random
+import statistics
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from db import Base
+from models import (
+    Application,
+    Application_type,
+    Department,
+    Employee,
+    EmployeeLanguage,
+    Gender,
+    Language,
+    Status,
+)
+
+BATCH_SIZE = 5000
+
+FIRST_NAMES = [
+    "Aarav", "Aditi", "Amit", "Ananya", "Arjun", "Deepa", "Farhan", "Gaurav", "Ishita", "Karan",
+    "Kavya", "Meera", "Mohit", "Neha", "Nikhil", "Pooja", "Priya", "Rahul", "Ravi", "Rohan",
+    "Sahil", "Sanjay", "Shreya", "Sneha", "Suresh", "Tanvi", "Varun", "Vikram", "Yash", "Zoya",
+]  # fmt: skip
+LAST_NAMES = [
+    "Agarwal", "Bose", "Chopra", "Das", "Desai", "Gupta", "Iyer", "Jain", "Joshi", "Kapoor",
+    "Khan", "Kumar", "Mehta", "Menon", "Mishra", "Nair", "Patel", "Pillai", "Rao", "Reddy",
+    "Saxena", "Shah", "Sharma", "Singh", "Sinha", "Srivastava", "Thakur", "Varma", "Verma", "Yadav",
+]  # fmt: skip
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def quiet_sql():
+    """Keep SQL echo out of the timings (and out of logging/employee_leave.log)."""
+    logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
+
+
+def seed(engine, departments=20, employees=5000, applications=20000, languages=10, seed=7):
+    """Drop, recreate and fill the schema with a reproducible synthetic dataset."""
+    rnd = random.Random(seed)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    dpt_ids = [uuid.uuid4() for _ in range(departments)]
+    emp_ids = [uuid.uuid4() for _ in range(employees)]
+    emp_department = {i: rnd.choice(dpt_ids) for i in emp_ids}
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Department),
+            [{"id": i, "name": f"Department {n}"} for n, i in enumerate(dpt_ids)],
+        )
+        lang_ids = [uuid.uuid4() for _ in range(languages)]
+        conn.execute(
+            insert(Language), [{"id": i, "name": f"Language {n}"} for n, i in enumerate(lang_ids)]
+        )
+        employee_rows = (
+            {
+                "id": i,
+                "department_id": emp_department[i],
+                "first_name": rnd.choice(FIRST_NAMES),
+                "last_name": rnd.choice(LAST_NAMES),
+                "dob": datetime(1970, 1, 1) + timedelta(days=rnd.randrange(12000)),
+                "gender": rnd.choice(list(Gender)),
+                "phone_number": f"9{n:09d}",
+                "personal_email_id": f"employee{n}@example.com",
+                "is_department_head": False,
+            }
+            for n, i in enumerate(emp_ids)
+        )
+        for rows in batched(employee_rows, BATCH_SIZE):
+            conn.execute(insert(Employee), rows)
+        if lang_ids:
+            pairs = (
+                {"id": uuid.uuid4(), "employee_id": employee_id, "language_id": language_id}
+                for employee_id in emp_ids
+                for language_id in rnd.sample(lang_ids, min(2, len(lang_ids)))
+            )
+            for rows in batched(pairs, BATCH_SIZE):
+                conn.execute(insert(EmployeeLanguage), rows)
+        rows = []
+        taken = set()
+        # Days of live WFH per department, the seed keeps ex_applications_wfh_overlap.
+        wfh_days = set()
+        for n in range(applications):
+            key = (
+                rnd.choice(emp_ids),
+                rnd.choice(list(Application_type)),
+                start + timedelta(days=rnd.randrange(365 * 4)),
+            )
+            if key in taken:
+                continue
+            employee_id, application_type, from_date = key
+            days = rnd.randrange(5)
+            status = rnd.choice(list(Status))
+            if application_type == Application_type.WFH and status != Status.REJECTED:
+                slot = {
+                    (emp_department[employee_id], from_date + timedelta(d)) for d in range(days + 1)
+                }
+                if slot & wfh_days:
+                    continue
+                wfh_days |= slot
+            taken.add(key)
+            rows.append(
+                {
+                    "id": uuid.uuid4(),
+                    "employee_id": employee_id,
+                    "department_id": emp_department[employee_id],
+                    "application_type": application_type,
+                    "from_date": from_date,
+                    "to_date": from_date + timedelta(days=days),
+                    "subject": f"Subject {n}",
+                    "reason": f"Reason {n} " + rnd.choice(["family", "travel", "medical"]),
+                    "status": status,
+                    "balance_before_approval": 20,
+                    "balance_after_approval": 19,
+                }
+            )
+            if len(rows) == BATCH_SIZE:
+                conn.execute(insert(Application), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(Application), rows)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """p50/p95/p99/mean in milliseconds."""
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def print_table(rows):
+    print(f"{'label':<36} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for label, stats in rows:
+        print(
+            f"{label:<36} {stats['count']:>6} {stats['p50']:>9.2f} {stats['p95']:>9.2f} "
+            f"{stats['p99']:>9.2f} {stats['mean']:>9.2f}"
+        )
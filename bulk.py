@@ -0,0 +1,543 @@
+"""Set based bulk create / update / delete for employees and applications.
+
+A batch is checked with one query per rule instead of one per row, written
+with a single executemany in a single transaction, and answered row by row.
+In ``atomic`` mode any failed row rolls the whole batch back.
+"""
+
+import json
+import uuid
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import IntegrityError
+
+import analytics
+import jobs
+import ledger
+from applications import (
+    INVERTED,
+    NO_EMPLOYEE,
+    VIOLATIONS,
+    as_timestamp,
+    follow_department,
+    inverted,
+    is_wfh_slot,
+    overlaps,
+    wfh_overlap,
+)
+from db import dialect_insert
+from models import Application, Application_type, Department, Employee
+from updates import DEPARTMENT_NOT_FOUND, EMPLOYEE_VIOLATIONS, bump, violation
+from validators import (
+    ApplicationBulkUpdateRequest,
+    BulkRowStatus,
+    CreateApplicationRequest,
+    EmployeeBulkUpdateRequest,
+    EmployeeCreateRequest,
+)
+
+SUCCESS = {BulkRowStatus.CREATED, BulkRowStatus.UPDATED, BulkRowStatus.DELETED}
+
+KEY_LABELS = {"slot": "employee, application type and from date"}
+
+
+async def read_rows(request):
+    """Rows of a bulk request: a JSON array, or one JSON object per line when
+    sent as ``application/x-ndjson``. Unparsable NDJSON lines are kept as the
+    ValueError so they get reported against their own index."""
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        rows = []
+        for line in body.decode().splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as error:
+                rows.append(error)
+        return rows
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        rows = None
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON. ")
+    return rows
+
+
+class BulkOutcome:
+    def __init__(self):
+        self.results = {}
+
+    def record(self, index, status, id=None, detail=None):
+        self.results[index] = {"index": index, "status": status, "id": id, "detail": detail}
+
+    @property
+    def failed(self):
+        return sum(result["status"] not in SUCCESS for result in self.results.values())
+
+    def response(self):
+        return {
+            "succeeded": len(self.results) - self.failed,
+            "failed": self.failed,
+            "results": [self.results[index] for index in sorted(self.results)],
+        }
+
+    def validate(self, rows, schema, exclude_unset=False):
+        """``(index, values)`` of the rows that pass ``schema``."""
+        valid = []
+        for index, row in enumerate(rows):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                valid.append((index, schema.parse_obj(row).dict(exclude_unset=exclude_unset)))
+            except (ValidationError, ValueError) as error:
+                self.record(index, BulkRowStatus.INVALID, detail=str(error))
+        return valid
+
+    def check_atomic(self, atomic):
+        if atomic and self.failed:
+            raise HTTPException(
+                status_code=422,
+                detail={"message": "Nothing was written, fix the failed rows. ", **self.response()},
+            )
+
+    async def commit(self, db, atomic):
+        if atomic and self.failed:
+            await db.rollback()
+            self.check_atomic(atomic)
+        await db.commit()
+        return self.response()
+
+
+def with_changes(outcome, rows):
+    """Drop the update rows that set nothing but their ``id``."""
+    kept = []
+    for index, row in rows:
+        if len(row) > 1:
+            kept.append((index, row))
+        else:
+            outcome.record(index, BulkRowStatus.INVALID, row["id"], "Nothing to update. ")
+    return kept
+
+
+def first_seen(outcome, rows, *keys):
+    """Drop the rows repeating a value of ``keys`` already used earlier in the batch."""
+    seen = {key: {} for key in keys}
+    unique = []
+    for index, row in rows:
+        clash = next((key for key in keys if row.get(key) in seen[key]), None)
+        if clash:
+            outcome.record(
+                index,
+                BulkRowStatus.DUPLICATE,
+                row.get("id"),
+                f"Same {KEY_LABELS.get(clash, clash.replace('_', ' '))} as row "
+                f"{seen[clash][row[clash]]} of this batch. ",
+            )
+            continue
+        for key in keys:
+            if row.get(key) is not None:
+                seen[key][row[key]] = index
+        unique.append((index, row))
+    return unique
+
+
+async def insert_new(db, model, rows):
+    """Insert ``rows`` in one executemany, skipping the ones a concurrent
+    writer inserted first; returns the ids that were actually written."""
+    if not rows:
+        return set()
+    for _, row in rows:
+        row["id"] = uuid.uuid4()
+    statement = dialect_insert(db, model).on_conflict_do_nothing().returning(model.id)
+    return set((await db.execute(statement, [row for _, row in rows])).scalars())
+
+
+def record_inserted(outcome, rows, inserted):
+    for index, row in rows:
+        if row["id"] in inserted:
+            outcome.record(index, BulkRowStatus.CREATED, row["id"])
+        else:
+            outcome.record(index, BulkRowStatus.DUPLICATE, detail="Already exist. ")
+
+
+async def delete_rows(db, model, ids, atomic):
+    outcome = BulkOutcome()
+    try:
+        deleted = set(
+            (await db.execute(delete(model).where(model.id.in_(ids)).returning(model.id))).scalars()
+        )
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=403, detail="Some rows are still referenced. ")
+    for index, row_id in enumerate(ids):
+        if row_id in deleted:
+            outcome.record(index, BulkRowStatus.DELETED, row_id)
+            deleted.discard(row_id)
+        else:
+            outcome.record(index, BulkRowStatus.NOT_FOUND, row_id, "Not found. ")
+    return await outcome.commit(db, atomic)
+
+
+async def existing_ids(db, model, rows):
+    ids = [row["id"] for _, row in rows]
+    return set((await db.scalars(select(model.id).where(model.id.in_(ids)))).all())
+
+
+async def existing_departments(db, rows):
+    """The departments the rows refer to that exist."""
+    ids = {row["department_id"] for _, row in rows if row.get("department_id") is not None}
+    if not ids:
+        return set()
+    return set((await db.scalars(select(Department.id).where(Department.id.in_(ids)))).all())
+
+
+# ******************************* Employees *********************************
+
+
+async def create_employees(db, rows, atomic):
+    outcome = BulkOutcome()
+    rows = first_seen(
+        outcome,
+        outcome.validate(rows, EmployeeCreateRequest),
+        "phone_number",
+        "personal_email_id",
+    )
+    phones = [row["phone_number"] for _, row in rows]
+    emails = [row["personal_email_id"] for _, row in rows]
+    taken = (
+        await db.execute(
+            select(Employee.phone_number, Employee.personal_email_id).where(
+                or_(Employee.phone_number.in_(phones), Employee.personal_email_id.in_(emails))
+            )
+        )
+    ).all()
+    taken_phones = {phone for phone, _ in taken}
+    taken_emails = {email for _, email in taken}
+
+    new_rows = []
+    for index, row in rows:
+        if row["phone_number"] in taken_phones:
+            outcome.record(index, BulkRowStatus.DUPLICATE, detail="Phone number already exist. ")
+        elif row["personal_email_id"] in taken_emails:
+            outcome.record(index, BulkRowStatus.DUPLICATE, detail="Email id already exist. ")
+        else:
+            new_rows.append((index, row))
+    outcome.check_atomic(atomic)
+
+    record_inserted(outcome, new_rows, await insert_new(db, Employee, new_rows))
+    return await outcome.commit(db, atomic)
+
+
+async def update_employees(db, rows, atomic):
+    outcome = BulkOutcome()
+    rows = first_seen(
+        outcome,
+        with_changes(
+            outcome, outcome.validate(rows, EmployeeBulkUpdateRequest, exclude_unset=True)
+        ),
+        "id",
+        "phone_number",
+        "personal_email_id",
+    )
+    found = await existing_ids(db, Employee, rows)
+    departments = await existing_departments(db, rows)
+    phones = [row["phone_number"] for _, row in rows if row.get("phone_number")]
+    emails = [row["personal_email_id"] for _, row in rows if row.get("personal_email_id")]
+    owners = (
+        await db.execute(
+            select(Employee.id, Employee.phone_number, Employee.personal_email_id).where(
+                or_(Employee.phone_number.in_(phones), Employee.personal_email_id.in_(emails))
+            )
+        )
+    ).all()
+    phone_owner = {phone: owner for owner, phone, _ in owners}
+    email_owner = {email: owner for owner, _, email in owners}
+
+    changes = []
+    for index, row in rows:
+        if row["id"] not in found:
+            outcome.record(index, BulkRowStatus.NOT_FOUND, row["id"], "Employee not found. ")
+        elif row.get("department_id") is not None and row["department_id"] not in departments:
+            outcome.record(index, BulkRowStatus.NOT_FOUND, row["id"], DEPARTMENT_NOT_FOUND)
+        elif phone_owner.get(row.get("phone_number"), row["id"]) != row["id"]:
+            outcome.record(
+                index, BulkRowStatus.DUPLICATE, row["id"], "Phone number already exist. "
+            )
+        elif email_owner.get(row.get("personal_email_id"), row["id"]) != row["id"]:
+            outcome.record(index, BulkRowStatus.DUPLICATE, row["id"], "Email id already exist. ")
+        else:
+            changes.append((index, row))
+    changes = await move_applications(db, outcome, changes)
+    outcome.check_atomic(atomic)
+
+    await apply_updates(db, Employee, changes, outcome, EMPLOYEE_VIOLATIONS)
+    return await outcome.commit(db, atomic)
+
+
+async def move_applications(db, outcome, changes):
+    """The employee ``changes`` left once the live applications of the ones
+    changing department followed them (applications.follow_department); a
+    refused employee is a conflict row."""
+    departments = {row["id"]: row["department_id"] for _, row in changes if "department_id" in row}
+    try:
+        refused = await follow_department(db, departments)
+    except IntegrityError as error:
+        await db.rollback()
+        rejected = violation(error, VIOLATIONS)
+        if rejected is not None:
+            raise rejected
+        raise HTTPException(status_code=409, detail="Batch conflicts with a concurrent write. ")
+    kept = []
+    for index, row in changes:
+        if row["id"] in refused:
+            outcome.record(
+                index,
+                BulkRowStatus.CONFLICT,
+                row["id"],
+                "Work From Home already taken from the same department. ",
+            )
+        else:
+            kept.append((index, row))
+    return kept
+
+
+async def apply_updates(db, model, changes, outcome, rules):
+    # ORM bulk UPDATE by primary key: one executemany per distinct set of
+    # columns, moving the versions on like a single PATCH does. The rows were
+    # checked beforehand, a violation is a write that came in between; one
+    # of ``rules`` (see updates.violation) answers for its constraint.
+    if changes:
+        try:
+            await db.execute(bump(model), [row for _, row in changes])
+        except IntegrityError as error:
+            await db.rollback()
+            rejected = violation(error, rules)
+            if rejected is not None:
+                raise rejected
+            raise HTTPException(status_code=409, detail="Batch conflicts with a concurrent write. ")
+    for index, row in changes:
+        outcome.record(index, BulkRowStatus.UPDATED, row["id"])
+
+
+# ****************************** Applications *******************************
+
+
+async def department_of(db, rows):
+    """employee id -> department id for the employees the rows refer to."""
+    ids = {row["employee_id"] for _, row in rows if row["employee_id"] is not None}
+    if not ids:
+        return {}
+    found = await db.execute(
+        select(Employee.id, Employee.department_id).where(Employee.id.in_(ids))
+    )
+    return dict(found.all())
+
+
+async def taken_wfh(db, rows):
+    """Live WFH applications overlapping the WFH rows, by department; one query
+    for the whole batch following the rule of create_application."""
+    wanted = [row for _, row in rows if is_wfh_slot(row)]
+    if not wanted:
+        return {}
+    taken = await db.execute(
+        select(
+            Application.id, Application.department_id, Application.from_date, Application.to_date
+        ).where(
+            or_(
+                *(
+                    wfh_overlap(row["department_id"], row["from_date"], row["to_date"])
+                    for row in wanted
+                )
+            )
+        )
+    )
+    slots = {}
+    for row in taken:
+        slots.setdefault(row.department_id, []).append(dict(row._mapping))
+    return slots
+
+
+async def create_applications(db, rows, atomic):
+    outcome = BulkOutcome()
+    rows = outcome.validate(rows, CreateApplicationRequest)
+    for _, row in rows:
+        row["from_date"] = as_timestamp(row["from_date"])
+        row["to_date"] = as_timestamp(row["to_date"])
+        row["slot"] = (row["employee_id"], row["application_type"], row["from_date"])
+    rows = first_seen(outcome, rows, "slot")
+    for _, row in rows:
+        del row["slot"]
+
+    departments = await department_of(db, rows)
+    known = []
+    for index, row in rows:
+        if row["employee_id"] is not None and row["employee_id"] not in departments:
+            outcome.record(index, BulkRowStatus.NOT_FOUND, detail="Employee not found. ")
+            continue
+        row["department_id"] = departments.get(row["employee_id"])
+        known.append((index, row))
+
+    # Overlaps against the stored applications and against the earlier rows of the batch.
+    taken = await taken_wfh(db, known)
+    new_rows = []
+    for index, row in known:
+        if is_wfh_slot(row):
+            slots = taken.setdefault(row["department_id"], [])
+            if any(overlaps(row, slot) for slot in slots):
+                outcome.record(
+                    index,
+                    BulkRowStatus.CONFLICT,
+                    detail="Work From Home already taken from the same department. ",
+                )
+                continue
+            slots.append(row)
+        new_rows.append((index, row))
+    outcome.check_atomic(atomic)
+
+    inserted = await insert_new(db, Application, new_rows)
+    record_inserted(outcome, new_rows, inserted)
+    created = [row for _, row in new_rows if row["id"] in inserted]
+    await analytics.track(db, [], created)
+    await ledger.stamp(db, [row["id"] for row in created if ledger.uses_leave(row)])
+    await jobs.application_submitted(db, [row["id"] for row in created])
+    return await outcome.commit(db, atomic)
+
+
+async def current_applications(db, rows):
+    """id --> contribution (analytics.CONTRIBUTION columns) and version of the
+    applications ``rows`` update, as stored; locked until the commit."""
+    columns = (getattr(Application, name) for name in analytics.CONTRIBUTION)
+    found = await db.execute(
+        select(Application.id, Application.version, *columns)
+        .where(Application.id.in_([row["id"] for _, row in rows]))
+        .with_for_update()
+    )
+    return {
+        row.id: dict(analytics.contribution(dict(row._mapping)), version=row.version)
+        for row in found
+    }
+
+
+def moves(row):
+    """The update ``row`` can move its application onto a WFH slot."""
+    return bool(set(row) & {"application_type", "status", "from_date", "to_date"})
+
+
+async def moved_onto(db, changes, current):
+    """taken_wfh() for the slots the ``changes`` move their applications to."""
+    moving = [(index, {**current[row["id"]], **row}) for index, row in changes if moves(row)]
+    return await taken_wfh(db, moving)
+
+
+def free_wfh_slots(outcome, changes, current, taken):
+    """The ``changes`` that keep the work from home rule, applied one after
+    the other: a row leaves its stored slot once its update is kept, a
+    refused one (CONFLICT) keeps it for the rows after it."""
+    kept = []
+    for index, row in changes:
+        if moves(row):
+            stored = {**current[row["id"]], **row}
+            slots = taken.setdefault(stored["department_id"], [])
+            if is_wfh_slot(stored):
+                others = (slot for slot in slots if slot["id"] != row["id"])
+                if any(overlaps(stored, slot) for slot in others):
+                    outcome.record(
+                        index,
+                        BulkRowStatus.CONFLICT,
+                        row["id"],
+                        "Work From Home already taken from the same department. ",
+                    )
+                    continue
+            slots[:] = [slot for slot in slots if slot["id"] != row["id"]]
+            if is_wfh_slot(stored):
+                slots.append(stored)
+        kept.append((index, row))
+    return kept
+
+
+async def update_applications(db, rows, atomic):
+    outcome = BulkOutcome()
+    rows = first_seen(
+        outcome,
+        with_changes(
+            outcome, outcome.validate(rows, ApplicationBulkUpdateRequest, exclude_unset=True)
+        ),
+        "id",
+    )
+    current = await current_applications(db, rows)
+    changes = []
+    for index, row in rows:
+        if row["id"] not in current:
+            outcome.record(index, BulkRowStatus.NOT_FOUND, row["id"], "Application not found. ")
+            continue
+        for field in ("from_date", "to_date"):
+            if field in row:
+                row[field] = as_timestamp(row[field])
+        # Only one of the dates sent: the other is the stored one.
+        stored = {**current[row["id"]], **row}
+        if inverted(stored):
+            outcome.record(index, BulkRowStatus.INVALID, row["id"], INVERTED)
+            continue
+        if stored["application_type"] == Application_type.WFH and stored["employee_id"] is None:
+            outcome.record(index, BulkRowStatus.INVALID, row["id"], NO_EMPLOYEE)
+            continue
+        changes.append((index, row))
+    changes = free_wfh_slots(outcome, changes, current, await moved_onto(db, changes, current))
+    outcome.check_atomic(atomic)
+
+    ids = [row["id"] for _, row in changes]
+    changed = {name for _, row in changes for name in row}
+    before = None
+    if changed & set(analytics.CONTRIBUTION):
+        before = [analytics.contribution(current[row_id]) for row_id in ids]
+    await apply_updates(db, Application, changes, outcome, VIOLATIONS)
+    await analytics.track(db, before, await analytics.snapshot(db, ids, changed))
+    if before is not None:
+        await ledger.stamp(db, ids)
+    # The rows are locked: each update wrote the version after the one read.
+    decisions = [
+        (row["id"], row["status"], current[row["id"]]["version"] + 1)
+        for _, row in changes
+        if "status" in row and row["status"] != current[row["id"]]["status"]
+    ]
+    await jobs.application_decided(db, decisions)
+    return await outcome.commit(db, atomic)
+
+
+async def delete_applications(db, ids, atomic):
+    await analytics.track(db, await analytics.snapshot(db, ids), [])
+    return await delete_rows(db, Application, ids, atomic)
+
+
+async def purge_applications(db, before, status, application_type, batch_size):
+    """Delete the applications that ended before ``before`` (optionally only
+    of a status / type), ``batch_size`` rows per DELETE and transaction so a
+    large purge never holds its locks for long; returns the number deleted."""
+    before = as_timestamp(before)
+    # from_date <= to_date, the first condition lets ix_applications_from_date
+    # find the rows.
+    filters = [Application.from_date < before, Application.to_date < before]
+    if status:
+        filters.append(Application.status == status)
+    if application_type:
+        filters.append(Application.application_type == application_type)
+    batch = select(Application.id).where(*filters).limit(batch_size).scalar_subquery()
+    statement = (
+        delete(Application)
+        .where(Application.id.in_(batch))
+        .returning(*(getattr(Application, name) for name in analytics.CONTRIBUTION))
+        .execution_options(synchronize_session=False)
+    )
+
+    deleted = 0
+    while True:
+        rows = (await db.execute(statement)).all()
+        await analytics.track(db, [dict(row._mapping) for row in rows], [])
+        await db.commit()
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            return deleted
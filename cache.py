@@ -0,0 +1,142 @@
+"""Read-through cache for reference data (departments, languages).
+
+Entries hold the encoded JSON body of a response plus its ETag, so a hit
+costs neither a query nor serialization, and a client sending the ETag back
+in ``If-None-Match`` gets a 304 without a body.
+
+Backends:
+
+    memory --> per process LRU with a TTL (default).
+    redis  --> shared between workers, needs the ``redis`` package; any
+               client with the redis.asyncio API works (fakeredis in tests).
+    none   --> caching disabled.
+
+Write routes invalidate a whole namespace ("departments", "languages") after
+their commit. With the memory backend other workers only see the change once
+their TTL expires.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from settings import settings
+
+
+class MemoryBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete_prefix(self, prefix):
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+
+
+class RedisBackend:
+    def __init__(self, client, ttl, key_prefix="office:"):
+        self.client = client
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    async def get(self, key):
+        value = await self.client.get(self.key_prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value):
+        await self.client.set(self.key_prefix + key, json.dumps(value), ex=self.ttl)
+
+    async def delete_prefix(self, prefix):
+        keys = [key async for key in self.client.scan_iter(match=f"{self.key_prefix}{prefix}*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+class NullBackend:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value):
+        pass
+
+    async def delete_prefix(self, prefix):
+        pass
+
+
+class Cache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def fetch(self, key, load):
+        """Cached ``{"body", "etag"}`` entry for ``key``, built from ``await
+        load()`` on a miss. Exceptions of ``load`` (404s) are not cached."""
+        entry = await self.backend.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        body = json.dumps(jsonable_encoder(await load()), separators=(",", ":"))
+        entry = {"body": body, "etag": f'"{hashlib.sha1(body.encode()).hexdigest()}"'}
+        await self.backend.set(key, entry)
+        return entry
+
+    async def invalidate(self, namespace):
+        await self.backend.delete_prefix(f"{namespace}:")
+
+    async def response(self, request, key, load):
+        """JSON response for ``key`` with ETag / If-None-Match handling."""
+        entry = await self.fetch(key, load)
+        headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or entry["etag"] in {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }:
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+def make_backend():
+    if settings.cache_backend == "redis":
+        import redis.asyncio
+
+        client = redis.asyncio.from_url(settings.redis_url)
+        return RedisBackend(client, settings.cache_ttl)
+    if settings.cache_backend == "none":
+        return NullBackend()
+    return MemoryBackend(settings.cache_max_entries, settings.cache_ttl)
+
+
+cache = Cache(make_backend())
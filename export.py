@@ -0,0 +1,60 @@
+import csv
+import enum
+import io
+import json
+
+from fastapi.responses import StreamingResponse
+
+from db import new_session, stream_partitions
+from serialize import layout, plain, schema_columns
+
+EXPORT_BATCH_SIZE = 1000
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+async def export_rows(query, schema, export_format, open_session=new_session):
+    """Stream the rows of ``query`` as NDJSON or CSV lines.
+
+    Only the columns of the response ``schema`` are selected, as plain rows
+    (no ORM objects, no per row validation), and they are read in batches from
+    a server side cursor, so memory stays flat whatever the table size.
+    The generator owns its session, from ``open_session``: it outlives the
+    request handler.
+    """
+    names, dates = layout(schema)
+    query = schema_columns(query, schema)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == ExportFormat.CSV:
+        writer.writerow(names)
+
+    db = open_session()
+    try:
+        async for rows in stream_partitions(db, query, EXPORT_BATCH_SIZE):
+            for row in rows:
+                values = [plain(value, name in dates) for name, value in zip(names, row)]
+                if export_format == ExportFormat.CSV:
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(names, values))))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        await db.close()
+
+
+def export_response(query, schema, export_format, filename, open_session=new_session):
+    media_type = "text/csv" if export_format == ExportFormat.CSV else "application/x-ndjson"
+    return StreamingResponse(
+        export_rows(query, schema, export_format, open_session),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'},
+    )
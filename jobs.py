@@ -0,0 +1,318 @@
+"""Background jobs: side work of the requests (notifications, rebuilds) run
+after the response, out of the request's latency.
+
+The queue is the jobs table. enqueue() inserts in the caller's transaction,
+so a job exists exactly when the write that asked for it is committed; a
+repeated idempotency key is ignored (ON CONFLICT DO NOTHING) and the
+original job stays.
+
+Every app worker runs a dispatcher (unless JOBS_IN_APP is off; ``python
+-m jobs`` runs one on its own) that claims the due jobs with
+
+    UPDATE jobs SET status = 'RUNNING', attempts = attempts + 1, ...
+    WHERE id IN (SELECT id FROM jobs WHERE <due> ORDER BY run_after
+                 LIMIT <free slots> FOR UPDATE SKIP LOCKED)
+    RETURNING ...
+
+and runs at most JOBS_CONCURRENCY of them at a time, each in a session of
+its own. A job commits its own writes together with its DONE status. A
+failing one is queued again after 2**attempts seconds, then FAILED after
+JOBS_MAX_ATTEMPTS. A claim is a lease of JOBS_LEASE_SECONDS, so the jobs of
+a worker that died are claimed again when it expires. SQLite has no FOR
+UPDATE; it runs one writer at a time, which makes the same claim safe.
+"""
+
+import asyncio
+import logging
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_, select, update
+
+import analytics
+import ledger
+from db import dialect_insert, new_session
+from models import Application, Employee, Job, JobStatus, Status
+from settings import settings
+
+log = logging.getLogger(__name__)
+notifications = logging.getLogger("notifications")
+
+HANDLERS = {}
+# Kinds POST /jobs/ accepts; the others are queued by the app's own writes.
+PUBLIC = set()
+
+
+def handler(kind, public=False):
+    """Register the coroutine running the jobs of ``kind``; it gets a session
+    and the job payload, the dispatcher commits. ``public``: clients may
+    queue it through POST /jobs/, for handlers that need no payload."""
+
+    def register(function):
+        HANDLERS[kind] = function
+        if public:
+            PUBLIC.add(kind)
+        return function
+
+    return register
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ********************************* Enqueue **********************************
+
+
+async def enqueue(db, kind, payload, key=None):
+    """One job; returns its id (unless the key was taken already)."""
+    return (await enqueue_many(db, kind, [(payload, key)]))[0]
+
+
+async def enqueue_many(db, kind, items):
+    """Add one ``kind`` job per ``(payload, idempotency key)`` of ``items``,
+    in one INSERT of the caller's transaction. Payloads must be JSON."""
+    if not items:
+        return []
+    now = utcnow()
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "kind": kind,
+            "payload": payload,
+            "idempotency_key": key,
+            "status": JobStatus.QUEUED,
+            "attempts": 0,
+            "run_after": now,
+            "created_at": now,
+        }
+        for payload, key in items
+    ]
+    await db.execute(
+        dialect_insert(db, Job)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+    )
+    return [row["id"] for row in rows]
+
+
+async def submit(db, kind, payload, key=None):
+    """enqueue() for the jobs route: the job, a new one or the one already
+    holding ``key``."""
+    job_id = await enqueue(db, kind, payload, key)
+    await db.commit()
+    found = Job.id == job_id if key is None else Job.idempotency_key == key
+    return (await db.execute(select(Job).where(found))).scalar_one()
+
+
+# Application events; one job per application and outcome.
+async def application_submitted(db, application_ids):
+    await enqueue_many(
+        db,
+        "application.submitted",
+        [({"application_id": str(i)}, f"application.submitted:{i}") for i in application_ids],
+    )
+
+
+async def application_decided(db, decisions):
+    """``decisions``: (application id, status, version written) triples of the
+    applications whose status changed, PENDING ones are no decision. The
+    version keeps a decision taken again (approved, rejected, approved) from
+    being taken for a repeat of the first one."""
+    decisions = [decision for decision in decisions if decision[1] != Status.PENDING]
+    await enqueue_many(
+        db,
+        "application.decided",
+        [
+            (
+                {"application_id": str(i), "status": status.name},
+                f"application.decided:{i}:{status.name}:{version}",
+            )
+            for i, status, version in decisions
+        ],
+    )
+
+
+# ********************************* Handlers *********************************
+
+
+@handler("application.submitted")
+async def notify_department_head(db, payload):
+    application = await db.get(Application, uuid.UUID(payload["application_id"]))
+    if application is None or application.department_id is None:
+        return
+    heads = await db.execute(
+        select(Employee.id, Employee.personal_email_id).where(
+            Employee.department_id == application.department_id,
+            Employee.is_department_head.is_(True),
+        )
+    )
+    for head in heads:
+        notifications.info(
+            f"Application {application.id} waits for the approval of {head.personal_email_id}"
+        )
+
+
+@handler("application.decided")
+async def notify_employee(db, payload):
+    application = await db.get(Application, uuid.UUID(payload["application_id"]))
+    if application is None or application.employee_id is None:
+        return
+    if application.status.name != payload["status"]:
+        return  # decided otherwise since, that decision has a job of its own
+    employee = await db.get(Employee, application.employee_id)
+    notifications.info(
+        f"Application {application.id} of {employee.personal_email_id} is {payload['status']}"
+    )
+
+
+@handler("analytics.rebuild", public=True)
+async def rebuild_leave_summary(db, payload):
+    await analytics.rebuild_summary(db)
+
+
+@handler("ledger.rebuild", public=True)
+async def rebuild_leave_balances(db, payload):
+    await ledger.rebuild_balances(db)
+
+
+# ******************************** Dispatcher ********************************
+
+
+async def claim(slots):
+    """Lease up to ``slots`` due jobs to this worker."""
+    now = utcnow()
+    due = or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_after <= now),
+        # Lease of a dead worker expired.
+        and_(Job.status == JobStatus.RUNNING, Job.locked_until < now),
+    )
+    candidates = (
+        select(Job.id)
+        .where(due)
+        .order_by(Job.run_after)
+        .limit(slots)
+        .with_for_update(skip_locked=True)
+    )
+    statement = (
+        update(Job)
+        .where(Job.id.in_(candidates.scalar_subquery()))
+        .values(
+            status=JobStatus.RUNNING,
+            attempts=Job.attempts + 1,
+            locked_until=now + timedelta(seconds=settings.jobs_lease_seconds),
+        )
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    db = new_session()
+    try:
+        jobs = (await db.execute(statement)).all()
+        await db.commit()
+    finally:
+        await db.close()
+    return jobs
+
+
+async def finish(db, job_id, **values):
+    await db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def execute(job):
+    db = new_session()
+    try:
+        try:
+            if job.attempts > settings.jobs_max_attempts:
+                raise RuntimeError("lease expired too often")
+            if job.kind not in HANDLERS:
+                raise LookupError(f"no handler for {job.kind}")
+            await HANDLERS[job.kind](db, job.payload)
+            await finish(db, job.id, status=JobStatus.DONE, last_error=None)
+        except Exception:
+            await db.rollback()
+            error = traceback.format_exc(limit=5)
+            if job.attempts >= settings.jobs_max_attempts:
+                log.error(f"Job {job.id} ({job.kind}) failed for good: {error}")
+                await finish(db, job.id, status=JobStatus.FAILED, last_error=error)
+            else:
+                log.warning(f"Job {job.id} ({job.kind}) failed, will retry: {error}")
+                await finish(
+                    db,
+                    job.id,
+                    status=JobStatus.QUEUED,
+                    run_after=utcnow() + timedelta(seconds=2**job.attempts),
+                    last_error=error,
+                )
+    except Exception:
+        # The database is gone too, the lease will hand the job out again.
+        log.exception(f"Job {job.id} ({job.kind}) could not be recorded")
+    finally:
+        await db.close()
+
+
+async def dispatch(stopping):
+    """Claim and run jobs until ``stopping`` is set; at most
+    JOBS_CONCURRENCY at a time."""
+    running = set()
+    while not stopping.is_set():
+        slots = settings.jobs_concurrency - len(running)
+        jobs = []
+        if slots > 0:
+            try:
+                jobs = await claim(slots)
+            except Exception:
+                log.exception("Claiming jobs failed")
+        for job in jobs:
+            task = asyncio.create_task(execute(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if len(jobs) == slots:
+            # Every slot busy: claim again as soon as a job ends.
+            if running:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            await asyncio.wait_for(stopping.wait(), settings.jobs_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+    if running:
+        await asyncio.wait(running)
+
+
+dispatcher = None
+stopping = None
+
+
+def start():
+    global dispatcher, stopping
+    if dispatcher is None:
+        stopping = asyncio.Event()
+        dispatcher = asyncio.create_task(dispatch(stopping))
+
+
+async def stop():
+    """Let the running jobs end, claim no new ones."""
+    global dispatcher
+    if dispatcher is not None:
+        stopping.set()
+        await dispatcher
+        dispatcher = None
+
+
+async def work():
+    start()
+    try:
+        await dispatcher
+    finally:
+        await stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(work())
@@ -0,0 +1,193 @@
+"""Leave ledger: leave days used per employee and year, so a balance is one
+primary key lookup instead of a scan of the employee's applications.
+
+An approved LEAVE application uses all of its days (``to_date - from_date
++ 1``) in the year of its ``from_date``; pending, rejected and work from
+home applications use none. The balance is LEAVE_ALLOWANCE minus the days
+used that year.
+
+Every application write hands its before / after rows to analytics.track,
+which applies the change here in the same transaction, so a status moving
+to APPROVED (or away from it, or the dates of an approved leave changing)
+updates the employee's row atomically with the application.
+``python -m ledger rebuild`` recomputes the table from the applications in
+one INSERT ... SELECT ... GROUP BY.
+
+The balance_before_approval / balance_after_approval columns of an
+application are not sent by the client: stamp() sets them from the ledger
+when a write changes what the application uses.
+"""
+
+import asyncio
+import sys
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, and_, case, cast, delete, func, insert, select, update
+
+import analytics
+from db import dialect_insert, dialect_name, new_session
+from models import Application, Application_type, Employee, LeaveBalance, Status
+from settings import settings
+
+LEDGER_KEY = ("employee_id", "year")
+# Application columns stamp() sets, in the order of its values.
+BALANCES = ("balance_before_approval", "balance_after_approval")
+
+
+def year_of(db, column):
+    if dialect_name(db) == "postgresql":
+        return cast(func.extract("year", column), Integer)
+    return cast(func.strftime("%Y", column), Integer)
+
+
+def uses_leave(row):
+    return (
+        row.get("employee_id") is not None
+        and row["status"] == Status.APPROVED
+        and row["application_type"] == Application_type.LEAVE
+        and row["from_date"] is not None
+        and row["to_date"] is not None
+    )
+
+
+async def track(db, before, after):
+    """Apply the change from the ``before`` to the ``after`` application rows
+    (analytics.contribution dicts) to leave_balances."""
+    delta = {}
+    for rows, sign in ((before, -1), (after, 1)):
+        for row in rows:
+            if not uses_leave(row):
+                continue
+            first, last = analytics.as_day(row["from_date"]), analytics.as_day(row["to_date"])
+            key = (row["employee_id"], first.year)
+            delta[key] = delta.get(key, 0) + sign * ((last - first).days + 1)
+
+    # Always the same order, so concurrent writers lock the rows alike.
+    values = [
+        {"employee_id": employee_id, "year": year, "used": used}
+        for (employee_id, year), used in sorted(delta.items(), key=lambda item: str(item[0]))
+        if used
+    ]
+    if not values:
+        return
+    statement = dialect_insert(db, LeaveBalance).values(values)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=LEDGER_KEY,
+            set_={"used": LeaveBalance.used + statement.excluded.used},
+        )
+    )
+
+
+async def stamp(db, application_ids):
+    """Set the balance columns of the applications ``application_ids`` from
+    the ledger as it stands after the write: for an approved leave the
+    balance of its year after it and before it (plus its days), NULL for the
+    others. Returns id --> (before, after)."""
+    if not application_ids:
+        return {}
+    used = (
+        select(LeaveBalance.used)
+        .where(
+            LeaveBalance.employee_id == Application.employee_id,
+            LeaveBalance.year == year_of(db, Application.from_date),
+        )
+        .scalar_subquery()
+    )
+    after = settings.leave_allowance - func.coalesce(used, 0)
+    approved = and_(
+        Application.employee_id.is_not(None),
+        Application.status == Status.APPROVED,
+        Application.application_type == Application_type.LEAVE,
+        Application.from_date.is_not(None),
+        Application.to_date.is_not(None),
+    )
+    statement = (
+        update(Application)
+        .where(Application.id.in_(application_ids))
+        .values(
+            balance_before_approval=case((approved, after + analytics.days_of(db))),
+            balance_after_approval=case((approved, after)),
+        )
+        .returning(
+            Application.id, Application.balance_before_approval, Application.balance_after_approval
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return {row.id: tuple(row[1:]) for row in await db.execute(statement)}
+
+
+async def rebuild_balances(db):
+    """Recompute leave_balances from the applications."""
+    year = year_of(db, Application.from_date)
+    await db.execute(delete(LeaveBalance))
+    await db.execute(
+        insert(LeaveBalance).from_select(
+            [*LEDGER_KEY, "used"],
+            select(Application.employee_id, year, func.sum(analytics.days_of(db)))
+            .where(
+                Application.employee_id.is_not(None),
+                Application.status == Status.APPROVED,
+                Application.application_type == Application_type.LEAVE,
+                Application.from_date.is_not(None),
+                Application.to_date.is_not(None),
+            )
+            .group_by(Application.employee_id, year),
+        )
+    )
+
+
+async def balances(db, year, employee_id=None, department_id=None):
+    """Balances of one employee or of the employees of a department in
+    ``year``; employees without a ledger row haven't used any leave."""
+    used = func.coalesce(LeaveBalance.used, 0)
+    query = (
+        select(
+            Employee.id,
+            Employee.first_name,
+            Employee.last_name,
+            Employee.department_id,
+            used.label("used"),
+        )
+        .outerjoin(
+            LeaveBalance,
+            and_(LeaveBalance.employee_id == Employee.id, LeaveBalance.year == year),
+        )
+        .order_by(Employee.id)
+    )
+    if employee_id is not None:
+        query = query.where(Employee.id == employee_id)
+    if department_id is not None:
+        query = query.where(Employee.department_id == department_id)
+
+    rows = [
+        {
+            "employee_id": row.id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "department_id": row.department_id,
+            "year": year,
+            "allowance": settings.leave_allowance,
+            "used": row.used,
+            "balance": settings.leave_allowance - row.used,
+        }
+        for row in await db.execute(query)
+    ]
+    if employee_id is not None and not rows:
+        raise HTTPException(status_code=404, detail="Employee not found. ")
+    return rows
+
+
+async def rebuild():
+    db = new_session()
+    try:
+        await rebuild_balances(db)
+        await db.commit()
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m ledger rebuild")
+    asyncio.run(rebuild())
@@ -0,0 +1,176 @@
+"""Non-blocking structured logging.
+
+The request path only puts records on a queue (QueueHandler); a
+QueueListener thread formats them and writes the rotating log file. Every
+record carries the correlation id of the request that emitted it, taken from
+the ``X-Request-ID`` header or generated by RequestIdMiddleware.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from pathlib import Path
+
+from settings import settings
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps the current correlation id on the record. Runs in the request's
+    context, before the record crosses over to the listener thread."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps ``rate`` of the records below WARNING, all the others."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RecordQueueHandler(QueueHandler):
+    """QueueHandler that keeps the traceback apart from the message, so the
+    listener can still write it as its own field."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and record.exc_info[0] is not None:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def file_handler():
+    Path(settings.log_file).parent.mkdir(parents=True, exist_ok=True)
+    if settings.log_rotation == "time":
+        handler = TimedRotatingFileHandler(
+            settings.log_file, when=settings.log_when, backupCount=settings.log_backup_count
+        )
+    else:
+        handler = RotatingFileHandler(
+            settings.log_file,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backup_count,
+        )
+    if settings.log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s -- %(request_id)s -- %(message)s"))
+    return handler
+
+
+def configure_logging():
+    """Route the root logger through the queue; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    records = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(records)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+    # A DEBUG root would otherwise pull every statement in. When enabled, SQL
+    # is sampled at the source logger so dropped records never get queued.
+    sql = logging.getLogger("sqlalchemy.engine.Engine")
+    if settings.log_sql_sample_rate > 0:
+        sql.setLevel(logging.INFO)
+        sql.addFilter(SamplingFilter(settings.log_sql_sample_rate))
+    else:
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+    _listener = QueueListener(records, file_handler(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def after_fork():
+    """Give a forked worker a queue and listener thread of its own; the
+    thread of the parent's did not survive the fork."""
+    global _listener
+    if _listener is None:
+        return configure_logging()
+    records = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, RecordQueueHandler):
+            handler.queue = records
+    _listener = QueueListener(records, file_handler(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class RequestIdMiddleware:
+    """Sets the correlation id for the request and echoes it in the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        current = dict(scope["headers"]).get(header, b"").decode("latin-1") or uuid.uuid4().hex
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((header, current.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -1,105 +1,271 @@
+import functools
 import logging
+import os
 import uuid
+from datetime import date
 
 # from logging.config import dictConfig
 from typing import List
 
-from fastapi import Depends, FastAPI, HTTPException
+import anyio
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse
 
 # from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Query, Session
-
-from db import Base, SessionLocal, engin
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+import analytics
+import bulk
+import jobs
+import ledger
+import metrics
+import periods
+import profiling
+import replicas
+import upserts
+import warmup
+from applications import (
+    INVERTED,
+    NO_EMPLOYEE,
+    VIOLATIONS,
+    WFH_TAKEN,
+    ApplicationConflict,
+    EmployeeNotFound,
+    as_timestamp,
+    follow_department,
+    insert_application,
+    inverted,
+    wfh_taken,
+)
+from cache import cache
+from db import create_all, get_db, pool_stats
+from export import ExportFormat, export_response
+from log_config import RequestIdMiddleware, configure_logging
+from metrics import RequestMetricsMiddleware
 from models import (
     Application,
-    Base,
+    Application_type,
     Department,
     Employee,
     EmployeeLanguage,
-    Gender,
+    Job,
+    JobStatus,
     Language,
     Status,
 )
+from pagination import PageParams, paginate
+from profiling import ProfilingMiddleware
+from queries import (
+    application_fields,
+    application_filters,
+    application_includes,
+    comma_list,
+    embed,
+    employee_fields,
+    employee_filters,
+    employee_includes,
+    load_options,
+)
+from replicas import ReadYourWritesMiddleware, get_read_db
+from search import contains, ranked
+from serialize import rows_response, schema_columns
+from settings import settings
+from updates import EMPLOYEE_VIOLATIONS, delete_by_id, etag, update_by_id, violation
 from validators import *
 
-Base.metadata.create_all(bind=engin)
-
-formate_time = "%(asctime)s -- %(message)s"
-logging.basicConfig(
-    filename="logging/employee_leave.log",
-    level=logging.DEBUG,
-    format=formate_time,
-)
+configure_logging()
 log = logging.getLogger(__name__)
 # log.debug("This is my debug file.")
-app = FastAPI(debug=True)
+app = FastAPI(debug=settings.debug)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("startup")
+async def create_schema():
+    # The schema is owned by the migrations (``alembic upgrade head``);
+    # DB_CREATE_ALL=true is only a shortcut for throwaway local databases.
+    if settings.db_create_all:
+        await create_all()
+
+
+@app.on_event("startup")
+async def start_jobs():
+    if settings.jobs_in_app:
+        jobs.start()
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    await jobs.stop()
+
+
+@app.on_event("startup")
+async def start_replica_monitor():
+    replicas.start()
+
+
+@app.on_event("shutdown")
+async def stop_replica_monitor():
+    await replicas.stop()
+
+
+@app.on_event("startup")
+async def warm_up():
+    # Last startup event: the worker only takes traffic once it is done.
+    await warmup.warm_up(app)
 
 
 # Getting all employees from employees table
 @app.get(
     "/employee/",
     tags=["Employees"],
-    response_model=List[EmployeeResponse],
+    response_model=List[EmployeeDetailResponse],
+    response_model_exclude_unset=True,
 )
 async def all_employees(
-    gender: Gender | None = None,
-    email: str | None = None,
-    department_id: uuid.UUID | None = None,
-    search: str | None = None,
-    language_id: uuid.UUID | None = None,
-    db: Session = Depends(get_db),
+    query=Depends(employee_filters),
+    page: PageParams = Depends(),
+    includes=Depends(employee_includes),
+    fields=Depends(employee_fields),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """_Description:_
 
         This API will fetch employee from employees table,
-        according to provided options (Optional).
+        according to provided options (Optional), one page at a time.
 
     Argument:
 
         Department ID --> Optional, Format --> UUID.
         Gender --> Optional.
         Email --> Optional.
-        Search --> Optional, Description --> Search via first name.
+        Search --> Optional, Description --> Search via first + last name.
+        Limit --> Optional, Description --> Page size (server side cap applies).
+        Cursor --> Optional, Description --> Value of X-Next-Cursor from the previous page.
+        Offset --> Optional, Description --> Legacy offset pagination.
+        Include Total --> Optional, Description --> Estimated X-Total-Count header.
+        Include --> Optional, Description --> department, applications, languages (comma separated).
+        Fields --> Optional, Description --> Only these employee fields (comma separated).
 
     """
+    if not includes:
+        # Plain list: columns only, encoded without per row validation.
+        query = schema_columns(query, EmployeeResponse, fields)
+        all_data = await paginate(db, query, Employee.id, page)
+        return rows_response(all_data, EmployeeResponse, page.response, fields)
+    query = query.options(*load_options(includes, Employee, fields))
+    all_data = await paginate(db, query, Employee.id, page)
+    return embed(all_data, EmployeeResponse, includes, fields)
+
+
+# Exporting employees as a stream
+@app.get("/employee/export", tags=["Employees"])
+async def export_employees(
+    request: Request,
+    query=Depends(employee_filters),
+    format: ExportFormat = ExportFormat.NDJSON,
+):
+    """_Description:_
 
-    query = db.query(Employee)
-    if gender:
-        query = query.filter(Employee.gender == gender)
-    if email:
-        query = query.filter(Employee.personal_email_id == email)
-    if search:
-        query = query.filter(Employee.first_name.ilike(f"%{search}%"))
-    if department_id:
-        query = query.filter(Employee.department_id == department_id)
-    if language_id:
-        query = (
-            query.join(EmployeeLanguage, Language)
-            .filter(Employee.id == EmployeeLanguage.employee_id)
-            .filter(EmployeeLanguage.language_id == language_id)
-        )
+        This API will stream employees from employees table as NDJSON or CSV,
+        with the same filters as the employee list (Optional).
+
+    Argument:
+
+        Format --> Optional, Description --> ndjson (default) or csv.
+
+    """
+    open_session = functools.partial(replicas.read_session, replicas.sticky(request))
+    return export_response(query, EmployeeResponse, format, "employees", open_session)
+
+
+# Bulk insert / update / delete of employees
+@app.post("/employee/bulk/", response_model=BulkResponse, tags=["Employees"])
+async def bulk_create_employees(
+    request: Request,
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will create many employees in one transaction. Body is a JSON
+        array of employees, or one employee per line with content type
+        application/x-ndjson. Rows with an existing moblie number or email id
+        are reported, the others are created.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, one failed row cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with failed rows (nothing is written).
+    """
+    return await bulk.create_employees(db, await bulk.read_rows(request), atomic)
 
-    all_data = query.all()
-    return all_data
+
+@app.patch("/employee/bulk/", response_model=BulkResponse, tags=["Employees"])
+async def bulk_update_employees(
+    request: Request,
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will update many employees in one transaction. Body is a JSON
+        array (or NDJSON) of employee updates, each one with the employee id.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, one failed row cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with failed rows (nothing is written).
+    """
+    return await bulk.update_employees(db, await bulk.read_rows(request), atomic)
+
+
+@app.delete("/employee/bulk/", response_model=BulkResponse, tags=["Employees"])
+async def bulk_delete_employees(
+    ids: List[uuid.UUID] = Body(...),
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will delete the employees of the provided employee ids with
+        one statement.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, an unknown id cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with unknown ids (nothing is deleted).
+    """
+    return await bulk.delete_rows(db, Employee, ids, atomic)
 
 
 # Getting Emloyee by employe ID
 @app.get(
     "/employee/{emp_id}/",
-    response_model=EmployeeResponse,
+    response_model=EmployeeDetailResponse,
+    response_model_exclude_unset=True,
     tags=["Employees"],
 )
 async def employee_by_id(
     emp_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    response: Response,
+    includes=Depends(employee_includes),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Description:
@@ -109,22 +275,24 @@ async def employee_by_id(
     Argument:
 
         Employee ID --> Mandaotry, Format --> UUID
+        Include --> Optional, Description --> department, applications, languages (comma separated).
 
     Raises:
         HTTPException: Employee not found.
     """
-    query = db.query(Employee).where(Employee.id == emp_id).first()
+    query = await db.get(Employee, emp_id, options=load_options(includes))
     if not query:
         log.exception("Employee Not found")
         raise HTTPException(status_code=404, detail="Employee not found. ")
-    return query
+    response.headers["ETag"] = etag(query.version)
+    return embed([query], EmployeeResponse, includes)[0]
 
 
 # Inserting employee in employees table
 @app.post("/employee/", response_model=EmployeeResponse, tags=["Employees"])
 async def create_employee(
     employee: EmployeeCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Description:
@@ -136,13 +304,13 @@ async def create_employee(
 
         HTTPException: Phone number or email id already exist.
     """
-    phone = db.query(Employee).filter(Employee.phone_number == employee.phone_number).first()
+    phone = await db.scalar(select(Employee).where(Employee.phone_number == employee.phone_number))
     if phone:
         log.exception("Phone number already exist. ")
         raise HTTPException(status_code=403, detail="Phone number already exist. ")
 
-    email = (
-        db.query(Employee).filter(Employee.personal_email_id == employee.personal_email_id).first()
+    email = await db.scalar(
+        select(Employee).where(Employee.personal_email_id == employee.personal_email_id)
     )
     if email:
         log.debug("Email id already exist. ")
@@ -151,10 +319,18 @@ async def create_employee(
     try:
         emp_data = Employee(**employee.dict())
         db.add(emp_data)
-        db.commit()
-        db.refresh(emp_data)
+        await db.commit()
+        await db.refresh(emp_data)
 
         return emp_data
+    except IntegrityError as error:
+        # Lost the race against a concurrent insert, the unique index caught it.
+        await db.rollback()
+        rejected = violation(error, EMPLOYEE_VIOLATIONS)
+        if rejected is None:
+            raise
+        log.debug(rejected.detail)
+        raise rejected
     except Exception as error:
         return error
 
@@ -168,13 +344,17 @@ async def create_employee(
 async def update_employe_by_id(
     emp_id: uuid.UUID,
     user_input: EmployeeUpdateRequest,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
         This API will update employee according to provided employee id,
-        if employee wants to change moblie number or email id than
-        employee can't update this.
+        if the new moblie number or email id belongs to another employee
+        than employee can't update this. A new department also applies to
+        the employee's pending and approved applications. Send the ETag back
+        in If-Match to only update an unchanged employee.
 
     Argument:
 
@@ -182,41 +362,46 @@ async def update_employe_by_id(
 
     Raises:
         HTTPException: Phone number or email id already exist.
+        HTTPException: Department not found.
+        HTTPException: Work From Home already taken from same department.
+        HTTPException: Employee not found.
+        HTTPException: Employee changed since the If-Match ETag.
     """
-    phone = db.query(Employee).filter(Employee.phone_number == user_input.phone_number).first()
-    if phone:
-        log.debug("Phone number already exist. ")
-        raise HTTPException(status_code=403, detail="Phone number already exist.")
-    email = db.query(Employee).filter(Employee.phone_number == user_input.phone_number).first()
-    if email:
-        log.debug("Email id already exist. ")
-        raise HTTPException(status_code=403, detail="Email id already exist. ")
-    db_id = db.query(Employee).where(Employee.id == emp_id).first()
+    update_data = user_input.dict(exclude_unset=True)
     try:
-        if not db_id:
-            log.error("Employe not found. ")
-            raise HTTPException(status_code=404, detail="Employee not found. ")
-        update_data = user_input.dict(exclude_unset=True)
-        for field in db_id.__dict__:
-            if field in update_data:
-                setattr(db_id, field, update_data[field])
-        db.add(db_id)
-        db.commit()
-        db.refresh(db_id)
-        return db_id
-    except Exception as error:
-        return error
+        emp_data = await update_by_id(db, Employee, emp_id, update_data, if_match, "Employee")
+        # The live applications go along to the new department.
+        if "department_id" in update_data and await follow_department(
+            db, {emp_id: update_data["department_id"]}
+        ):
+            await db.rollback()
+            raise HTTPException(status_code=403, detail=WFH_TAKEN)
+        await db.commit()
+    except IntegrityError as error:
+        # A phone number or email id of another employee, no such department,
+        # or (Postgres) a WFH of the employee overlapping one of the new department.
+        await db.rollback()
+        rejected = violation(error, (*EMPLOYEE_VIOLATIONS, *VIOLATIONS))
+        if rejected is None:
+            raise
+        log.debug(rejected.detail)
+        raise rejected
+    response.headers["ETag"] = etag(emp_data["version"])
+    return emp_data
 
 
 # Delete employee
 @app.delete("/employee/{emp_id}/", tags=["Employees"])
 async def delete_employee_by_id(
     emp_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
-        This API will delete employee according to provided employee id.
+        This API will delete employee according to provided employee id, with
+        one statement. The employee languages go with the employee, the
+        applications stay without it.
 
     Argument:
 
@@ -224,18 +409,12 @@ async def delete_employee_by_id(
 
     Raises:
         HTTPException: Employee not found.
+        HTTPException: Employee changed since the If-Match ETag.
     """
-    delete_employee = db.query(Employee).where(Employee.id == emp_id).first()
-    if not delete_employee:
-        log.error("Employee not found. ")
-        raise HTTPException(status_code=404, detail="Employe not found. ")
-    try:
-        db.delete(delete_employee)
-        db.commit()
-        log.info("Employee deleted successfully. ")
-        return {"Message": f"Employe {delete_employee.id} deleted successfully."}
-    except Exception as error:
-        return error
+    await delete_by_id(db, Employee, emp_id, if_match, "Employee")
+    await db.commit()
+    log.info("Employee deleted successfully. ")
+    return {"Message": f"Employe {emp_id} deleted successfully."}
 
 
 # ********************* Working on Department table ****************
@@ -247,16 +426,22 @@ async def delete_employee_by_id(
     response_model=List[DepartmentResponse],
 )
 async def all_department(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Description:
 
-        This API will fetch all department from department table.
+        This API will fetch all department from department table (cached,
+        send the ETag back in If-None-Match to get a 304).
 
     """
-    department = db.query(Department).all()
-    return department
+
+    async def load():
+        department = (await db.scalars(select(Department))).all()
+        return [DepartmentResponse.from_orm(row) for row in department]
+
+    return await cache.response(request, "departments:all", load)
 
 
 @app.post(
@@ -266,7 +451,7 @@ async def all_department(
 )
 async def create_department(
     department: DepartmentCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
        Description:
@@ -278,18 +463,38 @@ async def create_department(
 
            HTTPException: Department already exist.
     """
-    duplicate_department = db.query(Department).filter(Department.name == department.name).first()
-    if duplicate_department:
+    add_dprt = await upserts.insert_new(db, Department, department.dict())
+    if add_dprt is None:
         log.debug(f"{department.name} already exist. ")
         raise HTTPException(status_code=403, detail=f"{department.name} already exist. ")
-    add_dprt = Department(**department.dict())
-    try:
-        db.add(add_dprt)
-        db.commit()
-        db.refresh(add_dprt)
-        return add_dprt
-    except Exception as error:
-        return error
+    await db.commit()
+    await cache.invalidate("departments")
+    return add_dprt
+
+
+@app.put(
+    "/department/",
+    response_model=DepartmentResponse,
+    tags=["Departments"],
+)
+async def ensure_department(
+    department: DepartmentCreateRequest,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+       Description:
+
+           This API will return the department of the provided name, created
+           (status 201) if it doesn't exist yet.
+
+    """
+    dpt_data, created = await upserts.ensure(db, Department, department.dict())
+    if created:
+        await db.commit()
+        await cache.invalidate("departments")
+        response.status_code = 201
+    return dpt_data
 
 
 @app.get(
@@ -299,7 +504,8 @@ async def create_department(
 )
 async def department_by_id(
     dpt_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Description:
@@ -313,11 +519,15 @@ async def department_by_id(
     Raises:
         HTTPException: Department not found.
     """
-    dpt_data = db.query(Department).where(Department.id == dpt_id).first()
-    if not dpt_data:
-        log.debug("Department not found. ")
-        raise HTTPException(status_code=404, detail="Department not found. ")
-    return dpt_data
+
+    async def load():
+        dpt_data = await db.get(Department, dpt_id)
+        if not dpt_data:
+            log.debug("Department not found. ")
+            raise HTTPException(status_code=404, detail="Department not found. ")
+        return DepartmentResponse.from_orm(dpt_data)
+
+    return await cache.response(request, f"departments:{dpt_id}", load)
 
 
 @app.patch(
@@ -328,12 +538,15 @@ async def department_by_id(
 async def update_department_by_id(
     dpt_id: uuid.UUID,
     user_input: DepartmentUpdateRequest,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Description:
 
-        This API will update department according to provided department id.
+        This API will update department according to provided department id,
+        only if unchanged since the If-Match ETag (Optional).
 
     Argument:
 
@@ -341,32 +554,33 @@ async def update_department_by_id(
 
     Raises:
         HTTPException: Department not found.
+        HTTPException: Department already exist.
+        HTTPException: Department changed since the If-Match ETag.
     """
-    db_id = db.query(Department).where(Department.id == dpt_id).first()
     try:
-        if not db_id:
-            log.debug("Department not found. ")
-            raise HTTPException(status_code=404, detail="Department not found. ")
-        update_department = user_input.dict(exclude_unset=True)
-        for field in update_department:
-            if field in update_department:
-                setattr(db_id, field, update_department[field])
-        db.add(db_id)
-        db.commit()
-        db.refresh(db_id)
-        return db_id
-    except Exception as error:
-        return error
+        dpt_data = await update_by_id(
+            db, Department, dpt_id, user_input.dict(exclude_unset=True), if_match, "Department"
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=403, detail=f"{user_input.name} already exist. ")
+    await cache.invalidate("departments")
+    response.headers["ETag"] = etag(dpt_data["version"])
+    return dpt_data
 
 
 @app.delete("/department/{dpt_id}", tags=["Departments"])
 async def delete_department(
     dpt_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
-        This API will delete department according to provided department id.
+        This API will delete department according to provided department id,
+        with one statement. Its employees and applications are left without
+        department.
 
     Argument:
 
@@ -374,18 +588,14 @@ async def delete_department(
 
     Raises:
         HTTPException: Department not found.
+        HTTPException: Department changed since the If-Match ETag.
     """
-    DataInDpt = db.query(Department).where(Department.id == dpt_id).first()
-    if not DataInDpt:
-        log.debug("Department not found. ")
-        raise HTTPException(status_code=404, detail="Department not found. ")
-    try:
-        db.delete(DataInDpt)
-        db.commit()
-        log.debug("Department deleted successfully. ")
-        return {"Message": f"{DataInDpt.name} deleted successfully. "}
-    except Exception as error:
-        return error
+    dpt_data = await delete_by_id(db, Department, dpt_id, if_match, "Department")
+    await analytics.forget_department(db, dpt_id)
+    await db.commit()
+    await cache.invalidate("departments")
+    log.debug("Department deleted successfully. ")
+    return {"Message": f"{dpt_data['name']} deleted successfully. "}
 
 
 # ******************** Working on Application Table ***********************
@@ -394,21 +604,20 @@ async def delete_department(
 @app.get(
     "/application/",
     tags=["Applications"],
-    response_model=List[ApplicationResponse],
+    response_model=List[ApplicationDetailResponse],
+    response_model_exclude_unset=True,
 )
 async def all_applications(
-    status: Status | None = None,
-    application_type: Application_type | None = None,
-    from_date: date | None = None,
-    to_date: date | None = None,
-    search: str | None = None,
-    application_by_employee_id: uuid.UUID | None = None,
-    db: Session = Depends(get_db),
+    query=Depends(application_filters),
+    page: PageParams = Depends(),
+    includes=Depends(application_includes),
+    fields=Depends(application_fields),
+    db: AsyncSession = Depends(get_read_db),
 ):
-
     """_Description:_
 
-        This API will fetch all data from application table according to user requirements'.
+        This API will fetch data from application table according to user requirements',
+        one page at a time.
 
     Arguments:
 
@@ -416,27 +625,165 @@ async def all_applications(
         Application Type --> Optional.
         From Date --> Optional, Format --> yyyy-mm-dd.
         To Date --> Optional, Format --> yyyy-mm-dd.
+        Overlapping From / To --> Optional, Format --> yyyy-mm-dd: with a day in the range.
+        Within From / To --> Optional, Format --> yyyy-mm-dd: all days in the range.
+        Starting After --> Optional, Format --> yyyy-mm-dd.
         Search --> Optional: (Admin can search by reason).
         Application By Employee ID --> Optional, Format --> UUID.
+        Limit --> Optional, Description --> Page size (server side cap applies).
+        Cursor --> Optional, Description --> Value of X-Next-Cursor from the previous page.
+        Offset --> Optional, Description --> Legacy offset pagination.
+        Include Total --> Optional, Description --> Estimated X-Total-Count header.
+        Include --> Optional, Description --> employee, department (comma separated).
+        Fields --> Optional, Description --> Only these application fields (comma separated).
 
 
     """
-    query = db.query(Application)
-    if status:
-        query = query.filter(Application.status == status)
-    if application_type:
-        query = query.filter(Application.application_type == application_type)
-    if from_date:
-        query = query.filter(Application.from_date == from_date)
-    if to_date:
-        query = query.filter(Application.to_date == to_date)
-    if search:
-        query = query.filter(Application.reason.ilike(f"%{search}%"))
-    if application_by_employee_id:
-        query = query.filter(Application.employee_id == application_by_employee_id)
-
-    application_data = query.all()
-    return application_data
+    if not includes:
+        query = schema_columns(query, ApplicationResponse, fields)
+        application_data = await paginate(db, query, Application.id, page)
+        return rows_response(application_data, ApplicationResponse, page.response, fields)
+    query = query.options(*load_options(includes, Application, fields))
+    application_data = await paginate(db, query, Application.id, page)
+    return embed(application_data, ApplicationResponse, includes, fields)
+
+
+@app.get("/application/export", tags=["Applications"])
+async def export_applications(
+    request: Request,
+    query=Depends(application_filters),
+    format: ExportFormat = ExportFormat.NDJSON,
+):
+    """_Description:_
+
+        This API will stream applications from application table as NDJSON or CSV,
+        with the same filters as the application list (Optional).
+
+    Argument:
+
+        Format --> Optional, Description --> ndjson (default) or csv.
+
+    """
+    open_session = functools.partial(replicas.read_session, replicas.sticky(request))
+    return export_response(query, ApplicationResponse, format, "applications", open_session)
+
+
+@app.get("/calendar/out/", tags=["Applications"], response_model=List[CalendarDepartment])
+async def out_of_office(
+    day: date,
+    department_id: uuid.UUID | None = None,
+    application_type: Application_type | None = None,
+    status: Status | None = Status.APPROVED,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """_Description:_
+
+        This API will return who is out (on leave or working from home) on a day,
+        per department, from the applications covering that day.
+
+    Argument:
+
+        Day --> Mandatory, Format --> yyyy-mm-dd.
+        Department ID --> Optional, Format --> UUID.
+        Application Type --> Optional (both by default).
+        Status --> Optional (APPROVED by default).
+
+    """
+    return await periods.out_on(db, day, department_id, application_type, status)
+
+
+@app.post("/application/bulk/", response_model=BulkResponse, tags=["Applications"])
+async def bulk_create_applications(
+    request: Request,
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will create many applications in one transaction. Body is a JSON
+        array of applications, or one application per line with content type
+        application/x-ndjson. Same rules as a single application apply.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, one failed row cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with failed rows (nothing is written).
+    """
+    return await bulk.create_applications(db, await bulk.read_rows(request), atomic)
+
+
+@app.patch("/application/bulk/", response_model=BulkResponse, tags=["Applications"])
+async def bulk_update_applications(
+    request: Request,
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will update many applications in one transaction. Body is a JSON
+        array (or NDJSON) of application updates, each one with the application id.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, one failed row cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with failed rows (nothing is written).
+    """
+    return await bulk.update_applications(db, await bulk.read_rows(request), atomic)
+
+
+@app.delete("/application/bulk/", response_model=BulkResponse, tags=["Applications"])
+async def bulk_delete_applications(
+    ids: List[uuid.UUID] = Body(...),
+    atomic: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will delete the applications of the provided application ids
+        with one statement.
+
+    Argument:
+
+        Atomic --> Optional, Description --> If true, an unknown id cancels the whole batch.
+
+    Raises:
+
+        HTTPException: Atomic batch with unknown ids (nothing is deleted).
+    """
+    return await bulk.delete_applications(db, ids, atomic)
+
+
+@app.delete("/application/purge/", response_model=PurgeResponse, tags=["Applications"])
+async def purge_applications(
+    before: date,
+    status: Status | None = None,
+    application_type: Application_type | None = None,
+    batch_size: int = Query(5000, ge=1, le=50000),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will delete the applications that ended before the provided
+        date (Optional: only of a status / application type), a batch of rows
+        per statement and transaction.
+
+    Argument:
+
+        Before --> Mandatory, Format --> yyyy-mm-dd.
+        Status --> Optional.
+        Application Type --> Optional.
+        Batch Size --> Optional, Description --> Rows deleted per statement (max 50000).
+
+    """
+    deleted = await bulk.purge_applications(db, before, status, application_type, batch_size)
+    log.info(f"{deleted} applications purged. ")
+    return {"deleted": deleted}
 
 
 @app.post(
@@ -446,51 +793,62 @@ async def all_applications(
 )
 async def create_application(
     emp_application: CreateApplicationRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
         This API will create new application, if someone have already taken Work From home
-        then other employee can't take Work from home from the same department in same time period.
+        then other employee can't take Work from home from the same department in same time period
+        (overlapping from date / to date, rejected applications don't count).
 
     Raises:
 
         Message: Work From Home already taken from same department
+        Message: Employee already has an application of this type starting that day
 
     """
-    query = (
-        db.query(Application)
-        .join(Employee, Department)
-        .filter(Application.application_type == emp_application.application_type)
-        .filter(Department.id == Employee.department_id)
-        .filter(Application.from_date == emp_application.from_date)
-        # .filter(Application.to_date == emp_application.to_date)
-        .first()
-    )
-    if query:
+    try:
+        application_data = await insert_application(db, emp_application.dict())
+        contribution = analytics.contribution(application_data)
+        await analytics.track(db, [], [contribution])
+        if ledger.uses_leave(contribution):
+            stamped = await ledger.stamp(db, [application_data.id])
+            for name, value in zip(ledger.BALANCES, stamped[application_data.id]):
+                set_committed_value(application_data, name, value)
+        await jobs.application_submitted(db, [application_data.id])
+        await db.commit()
+        return application_data
+    except ApplicationConflict:
+        await db.rollback()
         log.info("Work From Home already taken from the same department. ")
         raise HTTPException(
             status_code=403,
             detail="Work From Home already taken from the same department",
         )
-    try:
-        application_data = Application(**emp_application.dict())
-        db.add(application_data)
-        db.commit()
-        db.refresh(application_data)
-        return application_data
-    except Exception as error:
-        return error
+    except EmployeeNotFound:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Employee not found. ")
+    except IntegrityError as error:
+        # Exclusion constraint (concurrent WFH) or an identical application.
+        await db.rollback()
+        rejected = violation(error, VIOLATIONS)
+        if rejected is None:
+            raise
+        log.info(f"Application rejected: {rejected.detail}")
+        raise rejected
 
 
 @app.get(
     "/application/{application_id}/",
-    response_model=ApplicationResponse,
+    response_model=ApplicationDetailResponse,
+    response_model_exclude_unset=True,
     tags=["Applications"],
 )
 async def application_by_id(
     application_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    response: Response,
+    includes=Depends(application_includes),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description_
 
@@ -499,16 +857,18 @@ async def application_by_id(
     Argument:
 
         Application ID --> mandatory, Format --> UUID
+        Include --> Optional, Description --> employee, department (comma separated).
 
     Raises:
 
         HTTPException: Application not found.
     """
-    query = db.query(Application).where(Application.id == application_id).first()
+    query = await db.get(Application, application_id, options=load_options(includes))
     if not query:
         log.debug("Application not found. ")
         raise HTTPException(status_code=404, detail="Application not found. ")
-    return query
+    response.headers["ETag"] = etag(query.version)
+    return embed([query], ApplicationResponse, includes)[0]
 
 
 @app.patch(
@@ -519,11 +879,15 @@ async def application_by_id(
 async def update_application_by_id(
     application_id: uuid.UUID,
     user_input: UpdateApplicationRequest,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
-        This API will update application according to provided application id.
+        This API will update application according to provided application id,
+        only if unchanged since the If-Match ETag (Optional). Approving a leave
+        (status APPROVED) takes its days from the employee's leave balance.
 
     Argument:
 
@@ -531,28 +895,54 @@ async def update_application_by_id(
 
     Raises:
         HTTPException: Application not found.
+        HTTPException: Application changed since the If-Match ETag.
+        HTTPException: to_date before from_date.
+        HTTPException: Work From Home without an employee.
+        HTTPException: Work From Home already taken from same department.
     """
-    query = db.query(Application).where(Application.id == application_id).first()
+    update_data = user_input.dict(exclude_unset=True)
+    for field in ("from_date", "to_date"):
+        if field in update_data:
+            update_data[field] = as_timestamp(update_data[field])
+    # Only costs a query when the PATCH sets a column the ledger / summary count.
+    before = await analytics.snapshot(db, [application_id], update_data)
+    if before:
+        stored = {**before[0], **update_data}
+        if inverted(stored):
+            raise HTTPException(status_code=400, detail=INVERTED)
+        if stored["application_type"] == Application_type.WFH and stored["employee_id"] is None:
+            raise HTTPException(status_code=400, detail=NO_EMPLOYEE)
+        if await wfh_taken(db, stored, [application_id]):
+            log.info("Work From Home already taken from the same department. ")
+            raise HTTPException(status_code=403, detail=WFH_TAKEN)
     try:
-        if not query:
-            log.debug("Application not found. ")
-            raise HTTPException(status_code=404, detail="Application not found. ")
-        update_data = user_input.dict(exclude_unset=True)
-        for field in query.__dict__:
-            if field in update_data:
-                setattr(query, field, update_data[field])
-        db.add(query)
-        db.commit()
-        db.refresh(query)
-        return query
-    except Exception as error:
-        return error
+        application_data = await update_by_id(
+            db, Application, application_id, update_data, if_match, "Application"
+        )
+    except IntegrityError as error:
+        # Postgres exclusion constraint: the new dates / status take a WFH slot.
+        await db.rollback()
+        rejected = violation(error, VIOLATIONS)
+        if rejected is None:
+            raise
+        raise rejected
+    await analytics.track(db, before, [analytics.contribution(application_data)])
+    if before is not None:
+        stamped = await ledger.stamp(db, [application_id])
+        application_data.update(zip(ledger.BALANCES, stamped[application_id]))
+    if "status" in update_data and update_data["status"] != before[0]["status"]:
+        decision = (application_id, update_data["status"], application_data["version"])
+        await jobs.application_decided(db, [decision])
+    await db.commit()
+    response.headers["ETag"] = etag(application_data["version"])
+    return application_data
 
 
 @app.delete("/application/{application_id}/", tags=["Applications"])
 async def delete_application_by_id(
     application_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
     """_Description:_
 
@@ -564,18 +954,15 @@ async def delete_application_by_id(
 
     Raises:
         HTTPException: Application not found.
+        HTTPException: Application changed since the If-Match ETag.
     """
-    query = db.query(Application).where(Application.id == application_id).first()
-    if not query:
-        log.debug("Application not found. ")
-        raise HTTPException(status_code=404, detail="Application not found. ")
-    try:
-        db.delete(query)
-        db.commit()
-        log.info(f"Application {query.id} deleted successfully. ")
-        return {"message": f"Application {query.id} deleted successfully. "}
-    except Exception as error:
-        return error
+    application_data = await delete_by_id(
+        db, Application, application_id, if_match, "Application"
+    )
+    await analytics.track(db, [analytics.contribution(application_data)], [])
+    await db.commit()
+    log.info(f"Application {application_id} deleted successfully. ")
+    return {"message": f"Application {application_id} deleted successfully. "}
 
 
 # ************************** Working on Language Table ************************
@@ -587,77 +974,92 @@ async def delete_application_by_id(
     response_model=List[LanguageResponse],
 )
 async def all_languages(
+    request: Request,
     search: str | None = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    query = db.query(Language)
-    if search:
-        query = query.filter(Language.name.ilike(f"%{search}%"))
-    query = query.all()
+    async def load():
+        query = select(Language)
+        if search:
+            query = query.where(contains(Language, search))
+        query = (await db.scalars(query)).all()
+        return [LanguageResponse.from_orm(row) for row in query]
 
-    return query
+    return await cache.response(request, f"languages:all:{search or ''}", load)
 
 
 @app.post("/language/", tags=["Languages"], response_model=LanguageResponse)
-async def create_language(user_input: CreateLanguage, db: Session = Depends(get_db)):
-    query = db.query(Language).filter(Language.name == user_input.name).first()
-    if query:
+async def create_language(user_input: CreateLanguage, db: AsyncSession = Depends(get_db)):
+    add_lang = await upserts.insert_new(db, Language, user_input.dict())
+    if add_lang is None:
         raise HTTPException(status_code=403, detail=f"{user_input.name} language already exist. ")
+    await db.commit()
+    await cache.invalidate("languages")
+    return add_lang
 
-    add_lang = Language(**user_input.dict())
-    try:
-        db.add(add_lang)
-        db.commit()
-        db.refresh(add_lang)
-        return add_lang
-    except Exception as error:
-        return error
+
+@app.put("/language/", tags=["Languages"], response_model=LanguageResponse)
+async def ensure_language(
+    user_input: CreateLanguage,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+):
+    lang_data, created = await upserts.ensure(db, Language, user_input.dict())
+    if created:
+        await db.commit()
+        await cache.invalidate("languages")
+        response.status_code = 201
+    return lang_data
 
 
 @app.get("/language/{lang_id}/", tags=["Languages"], response_model=LanguageResponse)
-async def language_by_id(lang_id: uuid.UUID, db: Session = Depends(get_db)):
-    query = db.query(Language).filter(Language.id == lang_id).first()
-    if not query:
-        raise HTTPException(status_code=404, detail=f"{lang_id} not found. ")
-    return query
+async def language_by_id(
+    lang_id: uuid.UUID,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+):
+    async def load():
+        query = await db.get(Language, lang_id)
+        if not query:
+            raise HTTPException(status_code=404, detail=f"{lang_id} not found. ")
+        return LanguageResponse.from_orm(query)
+
+    return await cache.response(request, f"languages:{lang_id}", load)
 
 
 @app.patch("/language/{lang_id}/", tags=["Languages"], response_model=LanguageResponse)
 async def update_language_by_id(
     lang_id: uuid.UUID,
     user_input: UpdateLanguage,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
-    # lng_name = db.query(Language).filter(Language.name == user_input.name).first()
-    # if lng_name:
-    #     raise HTTPException(status_code=403, detail=f"{user_input.name} already exist. ")
-    query = db.query(Language).where(Language.id == lang_id).first()
     try:
-        if not query:
-            raise HTTPException(status_code=404, detail=f"{lang_id} not found. ")
-
-        update_data = user_input.dict(exclude_unset=True)
-        for field in update_data:
-            if field in update_data:
-                setattr(query, field, update_data[field])
-        db.add(query)
-        db.commit()
-        db.refresh(query)
-        return query
-    except Exception as error:
-        return error
+        lang_data = await update_by_id(
+            db, Language, lang_id, user_input.dict(exclude_unset=True), if_match, "Language"
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=403, detail=f"{user_input.name} language already exist. ")
+    await cache.invalidate("languages")
+    response.headers["ETag"] = etag(lang_data["version"])
+    return lang_data
 
 
 @app.delete(
     "/language/{lang_id}/",
     tags=["Languages"],
 )
-async def delete_language_by_id(lang_id: uuid.UUID, db: Session = Depends(get_db)):
-    query = db.query(Language).where(Language.id == lang_id).first()
-    if not query:
-        raise HTTPException(status_code=404, detail=f"{lang_id} not found. ")
-    db.delete(query)
-    db.commit()
+async def delete_language_by_id(
+    lang_id: uuid.UUID,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    await delete_by_id(db, Language, lang_id, if_match, "Language")
+    await db.commit()
+    await cache.invalidate("languages")
     return {"Message": f"{lang_id} deleted successfully. "}
 
 
@@ -669,9 +1071,9 @@ async def delete_language_by_id(lang_id: uuid.UUID, db: Session = Depends(get_db
     tags=["Employee Languages"],
     response_model=List[ResponseEmployeeLanguages],
 )
-async def all_employee_languages(db: Session = Depends(get_db)):
-    query = db.query(EmployeeLanguage).all()
-    return query
+async def all_employee_languages(db: AsyncSession = Depends(get_db)):
+    query = schema_columns(select(EmployeeLanguage), ResponseEmployeeLanguages)
+    return rows_response((await db.execute(query)).all(), ResponseEmployeeLanguages)
 
 
 @app.post(
@@ -681,16 +1083,62 @@ async def all_employee_languages(db: Session = Depends(get_db)):
 )
 async def create_emp_lang(
     user_input: CreateEmployeeLangaugaes,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    add_data = EmployeeLanguage(**user_input.dict())
-    try:
-        db.add(add_data)
-        db.commit()
-        db.refresh(add_data)
-        return add_data
-    except Exception as error:
-        return error
+    add_data = await upserts.insert_new(db, EmployeeLanguage, user_input.dict())
+    if add_data is None:
+        raise HTTPException(status_code=403, detail="Employee language already exist. ")
+    await db.commit()
+    return add_data
+
+
+@app.put(
+    "/employeelanguage/",
+    tags=["Employee Languages"],
+    response_model=ResponseEmployeeLanguages,
+)
+async def ensure_emp_lang(
+    user_input: CreateEmployeeLangaugaes,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+):
+    emplng_data, created = await upserts.ensure(db, EmployeeLanguage, user_input.dict())
+    if created:
+        await db.commit()
+        response.status_code = 201
+    return emplng_data
+
+
+@app.put(
+    "/employee/{emp_id}/languages/",
+    tags=["Employee Languages"],
+    response_model=List[ResponseEmployeeLanguages],
+)
+async def set_employee_languages(
+    emp_id: uuid.UUID,
+    language_ids: List[uuid.UUID] = Body(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will replace the languages of the employee with the provided
+        language ids (body: JSON array), in one statement; the pairs the
+        employee already has are kept as they are.
+
+    Argument:
+
+        Employee ID --> Mandaotry, Format --> UUID
+
+    Raises:
+        HTTPException: Employee or language not found.
+    """
+    await upserts.set_employee_languages(db, emp_id, list(dict.fromkeys(language_ids)))
+    await db.commit()
+    query = schema_columns(
+        select(EmployeeLanguage).where(EmployeeLanguage.employee_id == emp_id),
+        ResponseEmployeeLanguages,
+    )
+    return rows_response((await db.execute(query)).all(), ResponseEmployeeLanguages)
 
 
 @app.patch(
@@ -701,14 +1149,338 @@ async def create_emp_lang(
 async def update_employee_language_id(
     emplng_id: uuid.UUID,
     user_input: UpdateEmployeLanguage,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
-    query = db.query(EmployeeLanguage).where(EmployeeLanguage.id == emplng_id).first()
-    update_data = user_input.dict(exclude_unset=True)
-    for field in update_data:
-        if field in update_data:
-            setattr(db, field, update_data[field])
-    db.add(query)
-    db.commit()
-    db.refresh(query)
-    return query
+    try:
+        emplng_data = await update_by_id(
+            db, EmployeeLanguage, emplng_id, user_input.dict(), if_match, "Employee language"
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=403, detail="Employee language already exist. ")
+    response.headers["ETag"] = etag(emplng_data["version"])
+    return emplng_data
+
+
+# ****************************** Search ************************************
+
+
+@app.get(
+    "/search/employees/",
+    tags=["Search"],
+    response_model=List[EmployeeSearchResult],
+)
+async def search_employees(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will search employees by first + last name, tolerating typos,
+        best matches first.
+
+    Argument:
+
+        Q --> Mandatory, Description --> Text to search.
+        Limit --> Optional, Description --> Number of results (max 100).
+
+    """
+    results = await ranked(db, Employee, q, limit)
+    return [dict(EmployeeResponse.from_orm(row), rank=rank) for row, rank in results]
+
+
+@app.get(
+    "/search/applications/",
+    tags=["Search"],
+    response_model=List[ApplicationSearchResult],
+)
+async def search_applications(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will search applications by reason, tolerating typos,
+        best matches first.
+
+    Argument:
+
+        Q --> Mandatory, Description --> Text to search.
+        Limit --> Optional, Description --> Number of results (max 100).
+
+    """
+    results = await ranked(db, Application, q, limit)
+    return [dict(ApplicationResponse.from_orm(row), rank=rank) for row, rank in results]
+
+
+@app.get(
+    "/search/languages/",
+    tags=["Search"],
+    response_model=List[LanguageSearchResult],
+)
+async def search_languages(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will search languages by name, tolerating typos,
+        best matches first.
+
+    Argument:
+
+        Q --> Mandatory, Description --> Text to search.
+        Limit --> Optional, Description --> Number of results (max 100).
+
+    """
+    results = await ranked(db, Language, q, limit)
+    return [dict(LanguageResponse.from_orm(row), rank=rank) for row, rank in results]
+
+
+# ****************************** Analytics *********************************
+
+
+@app.get(
+    "/analytics/leave/",
+    response_model=List[LeaveReportRow],
+    response_model_exclude_unset=True,
+    tags=["Analytics"],
+)
+async def leave_analytics(
+    group_by: str = Query(
+        "department,status,application_type,month",
+        description="Comma separated: department, status, application_type, month.",
+    ),
+    department_id: uuid.UUID | None = None,
+    status: Status | None = None,
+    application_type: Application_type | None = None,
+    from_month: str | None = Query(None, regex=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    to_month: str | None = Query(None, regex=r"^\d{4}-(0[1-9]|1[0-2])$"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """_Description:_
+
+        This API will count applications and leave days grouped by the provided
+        dimensions, computed by the database. A leave counts in the month of its
+        from date, for all of its days.
+
+    Argument:
+
+        Group By --> Optional, Description --> Dimensions to group by (all four by default).
+        Department ID --> Optional, Format --> UUID.
+        Status --> Optional.
+        Application Type --> Optional.
+        From Month --> Optional, Format --> yyyy-mm.
+        To Month --> Optional, Format --> yyyy-mm.
+
+    """
+    filters = {
+        "department_id": department_id,
+        "status": status,
+        "application_type": application_type,
+        "from_month": from_month and analytics.month_start(from_month),
+        "to_month": to_month and analytics.month_start(to_month),
+    }
+    group_by = comma_list(group_by, analytics.DIMENSIONS, "dimension")
+    return await analytics.leave_report(db, group_by, filters)
+
+
+@app.post("/analytics/leave/rebuild/", tags=["Analytics"])
+async def rebuild_leave_summary(db: AsyncSession = Depends(get_db)):
+    """_Description:_
+
+    This API will recompute the leave summary table from the applications
+    (same as python -m analytics rebuild).
+
+    """
+    await analytics.rebuild_summary(db)
+    await db.commit()
+    return {"message": "Leave summary rebuilt. "}
+
+
+# ************************** Leave balances ********************************
+
+
+@app.get("/leave/balances/", tags=["Analytics"], response_model=List[LeaveBalanceResponse])
+async def leave_balances(
+    employee_id: uuid.UUID | None = None,
+    department_id: uuid.UUID | None = None,
+    year: int | None = Query(None, ge=1900, le=9999),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """_Description:_
+
+        This API will return the leave balance of one employee, or of every
+        employee of a department, read from the leave ledger: allowance, days
+        used by approved leave starting in the year, and what is left.
+
+    Argument:
+
+        Employee ID --> Optional, Format --> UUID.
+        Department ID --> Optional, Format --> UUID (one of the two is required).
+        Year --> Optional, Format --> yyyy (current year by default).
+
+    Raises:
+        HTTPException: Neither employee nor department given.
+        HTTPException: Employee not found.
+
+    """
+    if (employee_id is None) == (department_id is None):
+        raise HTTPException(status_code=400, detail="Provide either employee_id or department_id. ")
+    year = year or date.today().year
+    return await ledger.balances(db, year, employee_id, department_id)
+
+
+@app.post("/leave/balances/rebuild/", tags=["Analytics"])
+async def rebuild_leave_balances(db: AsyncSession = Depends(get_db)):
+    """_Description:_
+
+    This API will recompute the leave ledger from the applications
+    (same as python -m ledger rebuild).
+
+    """
+    await ledger.rebuild_balances(db)
+    await db.commit()
+    return {"message": "Leave balances rebuilt. "}
+
+
+# ******************************** Jobs ************************************
+
+
+@app.post("/jobs/", tags=["Jobs"], response_model=JobResponse, status_code=202)
+async def submit_job(
+    job: JobRequest,
+    idempotency_key: str | None = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will queue a background job (analytics.rebuild, ledger.rebuild,
+        ...). Sent again with the same Idempotency-Key header, it returns the
+        job queued the first time instead of a new one.
+
+    Raises:
+        HTTPException: Unknown job kind.
+
+    """
+    # The application events are queued by the writes, with the payload they need.
+    if job.kind not in jobs.PUBLIC:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown job kind {job.kind}, choose from {', '.join(sorted(jobs.PUBLIC))}. ",
+        )
+    return await jobs.submit(db, job.kind, job.payload, idempotency_key)
+
+
+@app.get("/jobs/", tags=["Jobs"], response_model=List[JobResponse])
+async def list_jobs(
+    status: JobStatus | None = None,
+    kind: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    """_Description:_
+
+        This API will list background jobs, newest first.
+
+    Argument:
+
+        Status --> Optional, QUEUED / RUNNING / DONE / FAILED.
+        Kind --> Optional.
+
+    """
+    query = select(Job).order_by(Job.created_at.desc(), Job.id)
+    if status:
+        query = query.where(Job.status == status)
+    if kind:
+        query = query.where(Job.kind == kind)
+    return (await db.execute(query.limit(limit))).scalars().all()
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"], response_model=JobResponse)
+async def get_job(job_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
+    """_Description:_
+
+        This API will return one background job: status, attempts, last error.
+
+    Raises:
+        HTTPException: Job not found.
+
+    """
+    job = await db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found. ")
+    return job
+
+
+# *************************** Monitoring ***********************************
+
+
+@app.get("/pool/stats/", tags=["Monitoring"])
+async def connection_pool_stats():
+    """_Description:_
+
+    This API will return connection pool usage of every engine: pool size,
+    connections in use, overflow and checkout wait time (avg / max / total);
+    for the read replicas also their last measured lag and whether they take reads.
+
+    """
+    return {**pool_stats(), **replicas.pool_stats()}
+
+
+@app.get("/cache/stats/", tags=["Monitoring"])
+async def reference_cache_stats():
+    """_Description:_
+
+    This API will return hit / miss counters of the reference data cache.
+
+    """
+    return cache.stats()
+
+
+@app.get("/metrics", tags=["Monitoring"])
+async def request_metrics():
+    """_Description:_
+
+    This API will return the request metrics of this worker process in the
+    Prometheus text format: latency histogram, requests by status, SQL
+    statements, DB time, rows and pool wait, per route.
+
+    """
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles/", tags=["Monitoring"], dependencies=[Depends(profiling.require_token)])
+async def list_profiles(route: str | None = None):
+    """_Description:_
+
+    This API will list the stored request profiles, newest first, optionally
+    of one route (its slug, "employee-emp_id"). Needs the X-Profile-Token header.
+
+    """
+    profiles = await anyio.to_thread.run_sync(profiling.stored)
+    return [profile for profile in profiles if route is None or profile["route"] == route]
+
+
+@app.get(
+    "/profiles/{profile_id}", tags=["Monitoring"], dependencies=[Depends(profiling.require_token)]
+)
+async def download_profile(profile_id: str):
+    """_Description:_
+
+    This API will download one request profile: speedscope JSON, or a
+    cProfile dump when pyinstrument isn't installed. Needs the
+    X-Profile-Token header.
+
+    Raises:
+        HTTPException: 404 for an unknown profile.
+
+    """
+    path = await anyio.to_thread.run_sync(profiling.find, profile_id)
+    return FileResponse(path, filename=os.path.basename(path))
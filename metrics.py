@@ -0,0 +1,258 @@
+"""Per request performance numbers, by route: latency, SQL statements, DB
+time, rows and connection pool wait.
+
+RequestMetricsMiddleware opens a RequestStats for every request in a
+context variable, so the SQLAlchemy events of that request add to it
+whichever greenlet or threadpool worker they run in. The numbers go back to
+the client as a ``Server-Timing`` header (as far as they are known when the
+headers leave) and into the per route totals that ``GET /metrics`` exposes
+in the Prometheus text format. Totals are per worker process.
+
+``rows`` is the driver's rowcount: rows returned by a SELECT on Postgres,
+rows written by INSERT / UPDATE / DELETE everywhere (SQLite reports no
+count for a SELECT).
+
+Statements slower than SLOW_QUERY_MS are logged by the "slow_query" logger
+with their parameters and, with SLOW_QUERY_EXPLAIN, the plan the database
+chooses for them (an extra EXPLAIN, only paid by the slow ones).
+"""
+
+import contextvars
+import logging
+import time
+
+from sqlalchemy import event
+
+from settings import settings
+
+log = logging.getLogger("slow_query")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements EXPLAIN accepts (no DDL, no transaction control).
+EXPLAINABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+
+
+class RouteTotals:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency = 0.0
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+
+    def add(self, stats, elapsed):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.latency += elapsed
+        self.statements += stats.statements
+        self.db_time += stats.db_time
+        self.rows += stats.rows
+        self.pool_wait += stats.pool_wait
+
+
+# (method, route) --> RouteTotals; (method, route, status) --> requests
+totals = {}
+responses = {}
+# endpoint --> route template, filled by route_label()
+route_labels = {}
+
+
+def reset():
+    totals.clear()
+    responses.clear()
+
+
+def add_pool_wait(waited):
+    """Called by the timed pools for every checkout."""
+    stats = request_stats.get()
+    if stats is not None:
+        stats.pool_wait += waited
+
+
+# ******************************** SQL events ********************************
+
+
+def instrument(engine):
+    """Count the statements of ``engine`` (a sync Engine) into the request
+    stats and log the slow ones."""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+    if conn.info.get("explaining"):
+        return
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+        stats.rows += max(cursor.rowcount, 0)
+    if settings.slow_query_ms and elapsed * 1000 >= settings.slow_query_ms:
+        log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+def handle_error(context):
+    # A failing statement gets no after_cursor_execute: drop its start.
+    conn = context.connection
+    started = conn.info.get("statement_started") if conn is not None else None
+    if started:
+        started.pop()
+
+
+def explainable(statement):
+    return statement.lstrip().split(None, 1)[0].upper() in EXPLAINABLE
+
+
+def explain(conn, statement, parameters):
+    """The plan of ``statement``, without running it. On Postgres an error
+    aborts the transaction, the EXPLAIN gets a savepoint of its own."""
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    else:
+        with conn.begin_nested():
+            rows = conn.exec_driver_sql("EXPLAIN " + statement, parameters).all()
+    return "\n".join(" ".join(str(value) for value in row) for row in rows)
+
+
+def log_slow_query(conn, statement, parameters, executemany, elapsed):
+    plan = None
+    if settings.slow_query_explain and not executemany and explainable(statement):
+        conn.info["explaining"] = True
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as error:
+            plan = f"EXPLAIN failed: {error}"
+        finally:
+            conn.info["explaining"] = False
+    log.warning(
+        "Slow query (%.1f ms): %s\nParameters: %s\nPlan:\n%s",
+        elapsed * 1000,
+        statement,
+        parameters,
+        plan,
+    )
+
+
+# ******************************** Middleware ********************************
+
+
+def route_label(scope):
+    """Template of the route that served the request ("/employee/{emp_id}/"),
+    so the metrics have one series per route and not per id."""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in route_labels:
+        paths = {
+            getattr(route, "endpoint", None): route.path for route in scope["app"].router.routes
+        }
+        route_labels[endpoint] = paths.get(endpoint, "unmatched")
+    return route_labels[endpoint]
+
+
+def server_timing(stats):
+    app = (time.perf_counter() - stats.started) * 1000
+    return (
+        f'app;dur={app:.1f}, db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} '
+        f'statements, {stats.rows} rows", pool;dur={stats.pool_wait * 1000:.1f}'
+    )
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stats).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            key = (scope["method"], route_label(scope))
+            totals.setdefault(key, RouteTotals()).add(stats, time.perf_counter() - stats.started)
+            responses[(*key, status)] = responses.get((*key, status), 0) + 1
+
+
+# ******************************** Exposition ********************************
+
+
+def labels(method, route, **extra):
+    pairs = {"method": method, "route": route, **extra}
+    return ",".join(f'{name}="{value}"' for name, value in pairs.items())
+
+
+def prometheus():
+    """The totals in the Prometheus text exposition format."""
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), route_totals in sorted(totals.items()):
+        for bound, count in zip(LATENCY_BUCKETS, route_totals.buckets):
+            lines.append(
+                f"http_request_duration_seconds_bucket{{{labels(method, route, le=bound)}}} "
+                f"{count}"
+            )
+        lines += [
+            f'http_request_duration_seconds_bucket{{{labels(method, route, le="+Inf")}}} '
+            f"{route_totals.count}",
+            f"http_request_duration_seconds_sum{{{labels(method, route)}}} "
+            f"{route_totals.latency}",
+            f"http_request_duration_seconds_count{{{labels(method, route)}}} "
+            f"{route_totals.count}",
+        ]
+
+    lines += [
+        "# HELP http_requests_total Requests by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in sorted(responses.items()):
+        lines.append(f"http_requests_total{{{labels(method, route, status=status)}}} {count}")
+
+    for name, attribute, help_text in (
+        ("db_statements_total", "statements", "SQL statements sent by route."),
+        ("db_time_seconds_total", "db_time", "Time spent in SQL statements by route."),
+        ("db_rows_total", "rows", "Rows returned or written by route (driver rowcount)."),
+        ("db_pool_wait_seconds_total", "pool_wait", "Connection pool checkout wait by route."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (method, route), route_totals in sorted(totals.items()):
+            lines.append(f"{name}{{{labels(method, route)}}} {getattr(route_totals, attribute)}")
+    return "\n".join(lines) + "\n"
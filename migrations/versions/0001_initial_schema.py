@@ -0,0 +1,75 @@
+"""initial schema
+
+The tables as main.py used to create them with Base.metadata.create_all().
+A database created that way is already at this revision:
+
+    alembic stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "departments",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("name", sa.VARCHAR()),
+    )
+    op.create_table(
+        "languages",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("name", sa.VARCHAR()),
+    )
+    op.create_table(
+        "employees",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("department_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("departments.id")),
+        sa.Column("first_name", sa.VARCHAR()),
+        sa.Column("last_name", sa.VARCHAR()),
+        sa.Column("dob", postgresql.TIMESTAMP()),
+        sa.Column("gender", sa.Enum("MALE", "FEMALE", "OTHER", name="gender")),
+        sa.Column("phone_number", sa.VARCHAR()),
+        sa.Column("personal_email_id", sa.VARCHAR()),
+        sa.Column("is_department_head", sa.BOOLEAN()),
+    )
+    op.create_table(
+        "applications",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("employee_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("employees.id")),
+        sa.Column("application_type", sa.Enum("LEAVE", "WFH", name="application_type")),
+        sa.Column("from_date", postgresql.TIMESTAMP()),
+        sa.Column("to_date", postgresql.TIMESTAMP()),
+        sa.Column("subject", sa.VARCHAR()),
+        sa.Column("reason", sa.VARCHAR()),
+        sa.Column("status", sa.Enum("PENDING", "APPROVED", "REJECTED", name="status")),
+        sa.Column("balance_before_approval", sa.INTEGER()),
+        sa.Column("balance_after_approval", sa.INTEGER()),
+    )
+    op.create_table(
+        "employeeslanguages",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("employee_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("employees.id")),
+        sa.Column("language_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("languages.id")),
+    )
+
+
+def downgrade():
+    op.drop_table("employeeslanguages")
+    op.drop_table("applications")
+    op.drop_table("employees")
+    op.drop_table("languages")
+    op.drop_table("departments")
+    for enum_name in ("status", "application_type", "gender"):
+        sa.Enum(name=enum_name).drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,82 @@
+"""indexes for the list filters and unique duplicate checks
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Repeated create_emp_lang calls left duplicate pairs behind, keep the first.
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "DELETE FROM employeeslanguages a USING employeeslanguages b "
+            "WHERE a.employee_id = b.employee_id AND a.language_id = b.language_id "
+            "AND a.id > b.id"
+        )
+    else:
+        op.execute(
+            "DELETE FROM employeeslanguages WHERE id NOT IN ("
+            "SELECT min(id) FROM employeeslanguages GROUP BY employee_id, language_id)"
+        )
+
+    # The check-then-insert of create_employee let the same phone number or
+    # email be stored twice: the row with the lowest id keeps it, the others
+    # are cleared (the people are not merged, their rows stay).
+    for column in ("phone_number", "personal_email_id"):
+        op.execute(
+            f"UPDATE employees SET {column} = NULL WHERE EXISTS ("
+            f"SELECT 1 FROM employees o WHERE o.{column} = employees.{column} "
+            "AND o.id < employees.id)"
+        )
+    # Same employee, type and start day: a repeated submission, keep the first.
+    op.execute(
+        "DELETE FROM applications WHERE EXISTS ("
+        "SELECT 1 FROM applications o WHERE o.employee_id = applications.employee_id "
+        "AND o.application_type = applications.application_type "
+        "AND o.from_date = applications.from_date AND o.id < applications.id)"
+    )
+
+    op.create_index("ix_employees_department_id_id", "employees", ["department_id", "id"])
+    op.create_index("ix_employees_gender_id", "employees", ["gender", "id"])
+    op.create_index("uq_employees_phone_number", "employees", ["phone_number"], unique=True)
+    op.create_index(
+        "uq_employees_personal_email_id", "employees", ["personal_email_id"], unique=True
+    )
+
+    op.create_index("ix_applications_status_id", "applications", ["status", "id"])
+    op.create_index("ix_applications_from_date", "applications", ["from_date"])
+    op.create_index(
+        "uq_applications_employee_id_type_from_date",
+        "applications",
+        ["employee_id", "application_type", "from_date"],
+        unique=True,
+    )
+
+    op.create_index(
+        "uq_employeeslanguages_employee_id_language_id",
+        "employeeslanguages",
+        ["employee_id", "language_id"],
+        unique=True,
+    )
+    op.create_index("ix_employeeslanguages_language_id", "employeeslanguages", ["language_id"])
+
+
+def downgrade():
+    op.drop_index("ix_employeeslanguages_language_id", "employeeslanguages")
+    op.drop_index("uq_employeeslanguages_employee_id_language_id", "employeeslanguages")
+    op.drop_index("uq_applications_employee_id_type_from_date", "applications")
+    op.drop_index("ix_applications_from_date", "applications")
+    op.drop_index("ix_applications_status_id", "applications")
+    op.drop_index("uq_employees_personal_email_id", "employees")
+    op.drop_index("uq_employees_phone_number", "employees")
+    op.drop_index("ix_employees_gender_id", "employees")
+    op.drop_index("ix_employees_department_id_id", "employees")
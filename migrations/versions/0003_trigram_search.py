@@ -0,0 +1,40 @@
+"""pg_trgm GIN indexes for the search filters
+
+Postgres only, other backends keep scanning (see search.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+TRIGRAM_INDEXES = {
+    "ix_employees_full_name_trgm": (
+        "employees",
+        "coalesce(first_name, '') || ' ' || coalesce(last_name, '')",
+    ),
+    "ix_applications_reason_trgm": ("applications", "reason"),
+    "ix_languages_name_trgm": ("languages", "name"),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, (table, expression) in TRIGRAM_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON {table} USING gin (({expression}) gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    for name in TRIGRAM_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
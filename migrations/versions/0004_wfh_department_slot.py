@@ -0,0 +1,70 @@
+"""department of an application for the work from home rule
+
+Adds applications.department_id (backfilled from the employee), the slot
+index for the overlap lookup and, on Postgres, the exclusion constraint that
+keeps live WFH applications of a department from overlapping. Overlapping
+rows already stored have to be rejected or removed before upgrading; rows
+with their dates inverted, which tsrange() refuses, are swapped.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    with op.batch_alter_table("applications") as batch:
+        batch.add_column(sa.Column("department_id", UUID(as_uuid=True)))
+        batch.create_foreign_key(
+            "applications_department_id_fkey", "departments", ["department_id"], ["id"]
+        )
+
+    if postgres:
+        op.execute(
+            "UPDATE applications SET department_id = employees.department_id "
+            "FROM employees WHERE employees.id = applications.employee_id"
+        )
+    else:
+        op.execute(
+            "UPDATE applications SET department_id = (SELECT employees.department_id "
+            "FROM employees WHERE employees.id = applications.employee_id)"
+        )
+
+    # Nothing validated the order of the dates.
+    op.execute(
+        "UPDATE applications SET from_date = to_date, to_date = from_date "
+        "WHERE from_date > to_date"
+    )
+
+    op.create_index(
+        "ix_applications_department_slot",
+        "applications",
+        ["department_id", "application_type", "from_date", "to_date"],
+    )
+    if postgres:
+        op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+        op.execute(
+            "ALTER TABLE applications ADD CONSTRAINT ex_applications_wfh_overlap "
+            "EXCLUDE USING gist (department_id WITH =, tsrange(from_date, to_date, '[]') WITH &&) "
+            "WHERE (application_type = 'WFH' AND status <> 'REJECTED')"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE applications DROP CONSTRAINT ex_applications_wfh_overlap")
+    op.drop_index("ix_applications_department_slot", "applications")
+    with op.batch_alter_table("applications") as batch:
+        batch.drop_constraint("applications_department_id_fkey", type_="foreignkey")
+        batch.drop_column("department_id")
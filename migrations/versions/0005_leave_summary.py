@@ -0,0 +1,68 @@
+"""leave_summary table for the leave analytics
+
+Filled from the existing applications; kept up to date by the application
+writes when ANALYTICS_SUMMARY is on (see analytics.py).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import ENUM, UUID
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# analytics.NO_DEPARTMENT
+NO_DEPARTMENT = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+COUNTED = (
+    "status IS NOT NULL AND application_type IS NOT NULL "
+    "AND from_date IS NOT NULL AND to_date IS NOT NULL"
+)
+
+
+def upgrade():
+    op.create_table(
+        "leave_summary",
+        sa.Column("department_id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column(
+            "status",
+            ENUM("PENDING", "APPROVED", "REJECTED", name="status", create_type=False),
+            primary_key=True,
+        ),
+        sa.Column(
+            "application_type",
+            ENUM("LEAVE", "WFH", name="application_type", create_type=False),
+            primary_key=True,
+        ),
+        sa.Column("applications", sa.Integer(), nullable=False),
+        sa.Column("days", sa.Integer(), nullable=False),
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "INSERT INTO leave_summary "
+            "SELECT coalesce(department_id, '" + NO_DEPARTMENT + "'), "
+            "date_trunc('month', from_date)::date, status, application_type, count(*), "
+            "sum(to_date::date - from_date::date + 1) "
+            f"FROM applications WHERE {COUNTED} GROUP BY 1, 2, 3, 4"
+        )
+    else:
+        op.execute(
+            "INSERT INTO leave_summary "
+            "SELECT coalesce(department_id, '" + NO_DEPARTMENT.replace("-", "") + "'), "
+            "date(from_date, 'start of month'), status, application_type, count(*), "
+            "sum(CAST(julianday(date(to_date)) - julianday(date(from_date)) AS INTEGER) + 1) "
+            f"FROM applications WHERE {COUNTED} GROUP BY 1, 2, 3, 4"
+        )
+
+
+def downgrade():
+    op.drop_table("leave_summary")
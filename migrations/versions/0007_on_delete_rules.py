@@ -0,0 +1,55 @@
+"""ON DELETE rules for the foreign keys
+
+The single statement DELETE routes leave the referencing rows to the
+database: employees and applications lose a deleted department / employee,
+employee languages go with their employee or language, a department that
+still has applications can't be deleted.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+# table --> (column, referred table, ON DELETE)
+FOREIGN_KEYS = {
+    "employees": [("department_id", "departments", "SET NULL")],
+    "applications": [
+        ("employee_id", "employees", "SET NULL"),
+        ("department_id", "departments", "RESTRICT"),
+    ],
+    "employeeslanguages": [
+        ("employee_id", "employees", "CASCADE"),
+        ("language_id", "languages", "CASCADE"),
+    ],
+}
+
+# The names Postgres gave the constraints of 0001 (and 0004 used); SQLite
+# reflects them unnamed, the convention lets batch mode find them by the same name.
+NAMING = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def set_on_delete(upgrade):
+    for table, keys in FOREIGN_KEYS.items():
+        with op.batch_alter_table(table, naming_convention=NAMING) as batch:
+            for column, referred, on_delete in keys:
+                name = f"{table}_{column}_fkey"
+                batch.drop_constraint(name, type_="foreignkey")
+                batch.create_foreign_key(
+                    name, referred, [column], ["id"], ondelete=on_delete if upgrade else None
+                )
+
+
+def upgrade():
+    set_on_delete(True)
+
+
+def downgrade():
+    set_on_delete(False)
@@ -0,0 +1,80 @@
+"""unique department and language names
+
+The check-then-insert of create_department / create_language let
+concurrent requests store the same name twice. Duplicates are merged into
+the row with the lowest id (references moved over, leave_summary totals
+added up), then the unique indexes the ON CONFLICT inserts rely on are
+created.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def duplicate(table, row):
+    """``row`` of ``table`` has a namesake with a lower id."""
+    return f"EXISTS (SELECT 1 FROM {table} o WHERE o.name = {row}.name AND o.id < {row}.id)"
+
+
+def keeper(table, reference):
+    """Id of the row kept for the name of the row ``reference`` points to."""
+    return (
+        f"(SELECT k.id FROM {table} d JOIN {table} k ON k.name = d.name "
+        f"WHERE d.id = {reference} AND NOT {duplicate(table, 'k')})"
+    )
+
+
+def merged(table):
+    return f"(SELECT d.id FROM {table} d WHERE {duplicate(table, 'd')})"
+
+
+def move_references(table, referencing, column):
+    op.execute(
+        f"UPDATE {referencing} SET {column} = {keeper(table, f'{referencing}.{column}')} "
+        f"WHERE {column} IN {merged(table)}"
+    )
+
+
+def upgrade():
+    move_references("departments", "employees", "department_id")
+    move_references("departments", "applications", "department_id")
+    op.execute(
+        "INSERT INTO leave_summary "
+        "SELECT " + keeper("departments", "leave_summary.department_id") + ", "
+        "month, status, application_type, sum(applications), sum(days) FROM leave_summary "
+        "WHERE department_id IN " + merged("departments") + " GROUP BY 1, 2, 3, 4 "
+        "ON CONFLICT (department_id, month, status, application_type) DO UPDATE SET "
+        "applications = leave_summary.applications + excluded.applications, "
+        "days = leave_summary.days + excluded.days"
+    )
+    op.execute("DELETE FROM leave_summary WHERE department_id IN " + merged("departments"))
+    op.execute("DELETE FROM departments WHERE id IN " + merged("departments"))
+
+    # An employee may have several of the merged languages, keep one pair per name.
+    op.execute(
+        "DELETE FROM employeeslanguages WHERE EXISTS ("
+        "SELECT 1 FROM employeeslanguages x "
+        "JOIN languages lx ON lx.id = x.language_id "
+        "JOIN languages l ON l.id = employeeslanguages.language_id "
+        "WHERE x.employee_id = employeeslanguages.employee_id "
+        "AND lx.name = l.name AND lx.id < l.id)"
+    )
+    move_references("languages", "employeeslanguages", "language_id")
+    op.execute("DELETE FROM languages WHERE id IN " + merged("languages"))
+
+    op.create_index("uq_departments_name", "departments", ["name"], unique=True)
+    op.create_index("uq_languages_name", "languages", ["name"], unique=True)
+
+
+def downgrade():
+    op.drop_index("uq_languages_name", "languages")
+    op.drop_index("uq_departments_name", "departments")
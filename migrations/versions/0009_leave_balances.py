@@ -0,0 +1,58 @@
+"""leave_balances table for the leave ledger
+
+Filled from the approved leave applications; kept up to date by every
+application write (see ledger.py).
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+USES_LEAVE = (
+    "employee_id IS NOT NULL AND status = 'APPROVED' AND application_type = 'LEAVE' "
+    "AND from_date IS NOT NULL AND to_date IS NOT NULL"
+)
+
+
+def upgrade():
+    op.create_table(
+        "leave_balances",
+        sa.Column("employee_id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("year", sa.Integer(), primary_key=True),
+        sa.Column("used", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["employee_id"],
+            ["employees.id"],
+            name="leave_balances_employee_id_fkey",
+            ondelete="CASCADE",
+        ),
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "INSERT INTO leave_balances "
+            "SELECT employee_id, extract(year FROM from_date)::integer, "
+            "sum(to_date::date - from_date::date + 1) "
+            f"FROM applications WHERE {USES_LEAVE} GROUP BY 1, 2"
+        )
+    else:
+        op.execute(
+            "INSERT INTO leave_balances "
+            "SELECT employee_id, CAST(strftime('%Y', from_date) AS INTEGER), "
+            "sum(CAST(julianday(date(to_date)) - julianday(date(from_date)) AS INTEGER) + 1) "
+            f"FROM applications WHERE {USES_LEAVE} GROUP BY 1, 2"
+        )
+
+
+def downgrade():
+    op.drop_table("leave_balances")
@@ -0,0 +1,41 @@
+"""jobs table for the background jobs
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+JOB_STATUS = sa.Enum("QUEUED", "RUNNING", "DONE", "FAILED", name="jobstatus")
+
+
+def upgrade():
+    op.create_table(
+        "jobs",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("kind", sa.VARCHAR(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("idempotency_key", sa.VARCHAR()),
+        sa.Column("status", JOB_STATUS, nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("run_after", sa.TIMESTAMP(), nullable=False),
+        sa.Column("locked_until", sa.TIMESTAMP()),
+        sa.Column("last_error", sa.VARCHAR()),
+        sa.Column("created_at", sa.TIMESTAMP(), nullable=False),
+    )
+    op.create_index("ix_jobs_status_run_after", "jobs", ["status", "run_after"])
+    op.create_index("uq_jobs_idempotency_key", "jobs", ["idempotency_key"], unique=True)
+
+
+def downgrade():
+    op.drop_table("jobs")
+    JOB_STATUS.drop(op.get_bind(), checkfirst=True)
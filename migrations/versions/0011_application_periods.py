@@ -0,0 +1,85 @@
+"""period index for the application date range filters
+
+Postgres gets a GiST index on the (from_date, to_date) range, the other
+backends a B-tree on (to_date, from_date) (see periods.py). The index covers
+every row and tsrange() refuses inverted dates, which nothing validated:
+those are swapped first, and the leave ledger and summary, which counted
+them negative, recomputed.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+# analytics.NO_DEPARTMENT
+NO_DEPARTMENT = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+COUNTED = (
+    "status IS NOT NULL AND application_type IS NOT NULL "
+    "AND from_date IS NOT NULL AND to_date IS NOT NULL"
+)
+USES_LEAVE = (
+    f"{COUNTED} AND employee_id IS NOT NULL "
+    "AND status = 'APPROVED' AND application_type = 'LEAVE'"
+)
+
+
+def swap_inverted():
+    swapped = op.get_bind().execute(
+        sa.text(
+            "UPDATE applications SET from_date = to_date, to_date = from_date "
+            "WHERE from_date > to_date"
+        )
+    )
+    if not swapped.rowcount:
+        return
+    if op.get_bind().dialect.name == "postgresql":
+        department = f"coalesce(department_id, '{NO_DEPARTMENT}')"
+        month = "date_trunc('month', from_date)::date"
+        year = "extract(year FROM from_date)::integer"
+        days = "to_date::date - from_date::date + 1"
+    else:
+        department = f"coalesce(department_id, '{NO_DEPARTMENT.replace('-', '')}')"
+        month = "date(from_date, 'start of month')"
+        year = "CAST(strftime('%Y', from_date) AS INTEGER)"
+        days = "CAST(julianday(date(to_date)) - julianday(date(from_date)) AS INTEGER) + 1"
+    op.execute("DELETE FROM leave_balances")
+    op.execute(
+        f"INSERT INTO leave_balances SELECT employee_id, {year}, sum({days}) "
+        f"FROM applications WHERE {USES_LEAVE} GROUP BY 1, 2"
+    )
+    op.execute("DELETE FROM leave_summary")
+    op.execute(
+        f"INSERT INTO leave_summary SELECT {department}, {month}, status, application_type, "
+        f"count(*), sum({days}) FROM applications WHERE {COUNTED} GROUP BY 1, 2, 3, 4"
+    )
+
+
+def upgrade():
+    swap_inverted()
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "CREATE INDEX ix_applications_period ON applications "
+            "USING gist (tsrange(from_date, to_date, '[]'))"
+        )
+    else:
+        op.create_index(
+            "ix_applications_to_date_from_date", "applications", ["to_date", "from_date"]
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_applications_period", "applications")
+    else:
+        op.drop_index("ix_applications_to_date_from_date", "applications")
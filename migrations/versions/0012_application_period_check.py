@@ -0,0 +1,74 @@
+"""from_date <= to_date check on applications
+
+Nothing validated the order of the dates before, inverted rows are swapped
+first. Their days were counted negative, so the leave ledger and summary are
+then recomputed, as ``python -m ledger rebuild`` / ``python -m analytics
+rebuild`` would.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+# analytics.NO_DEPARTMENT
+NO_DEPARTMENT = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+COUNTED = (
+    "status IS NOT NULL AND application_type IS NOT NULL "
+    "AND from_date IS NOT NULL AND to_date IS NOT NULL"
+)
+USES_LEAVE = (
+    f"{COUNTED} AND employee_id IS NOT NULL "
+    "AND status = 'APPROVED' AND application_type = 'LEAVE'"
+)
+
+
+def swap_inverted():
+    swapped = op.get_bind().execute(
+        sa.text(
+            "UPDATE applications SET from_date = to_date, to_date = from_date "
+            "WHERE from_date > to_date"
+        )
+    )
+    if not swapped.rowcount:
+        return
+    if op.get_bind().dialect.name == "postgresql":
+        department = f"coalesce(department_id, '{NO_DEPARTMENT}')"
+        month = "date_trunc('month', from_date)::date"
+        year = "extract(year FROM from_date)::integer"
+        days = "to_date::date - from_date::date + 1"
+    else:
+        department = f"coalesce(department_id, '{NO_DEPARTMENT.replace('-', '')}')"
+        month = "date(from_date, 'start of month')"
+        year = "CAST(strftime('%Y', from_date) AS INTEGER)"
+        days = "CAST(julianday(date(to_date)) - julianday(date(from_date)) AS INTEGER) + 1"
+    op.execute("DELETE FROM leave_balances")
+    op.execute(
+        f"INSERT INTO leave_balances SELECT employee_id, {year}, sum({days}) "
+        f"FROM applications WHERE {USES_LEAVE} GROUP BY 1, 2"
+    )
+    op.execute("DELETE FROM leave_summary")
+    op.execute(
+        f"INSERT INTO leave_summary SELECT {department}, {month}, status, application_type, "
+        f"count(*), sum({days}) FROM applications WHERE {COUNTED} GROUP BY 1, 2, 3, 4"
+    )
+
+
+def upgrade():
+    swap_inverted()
+    with op.batch_alter_table("applications") as batch:
+        batch.create_check_constraint("ck_applications_period", "from_date <= to_date")
+
+
+def downgrade():
+    with op.batch_alter_table("applications") as batch:
+        batch.drop_constraint("ck_applications_period", type_="check")
@@ -0,0 +1,38 @@
+"""applications.department_id ON DELETE SET NULL
+
+0007 made the key RESTRICT: a department that ever had an application could
+no longer be deleted, while its employees are left without department
+(SET NULL). The applications now follow the employees; their leave_summary
+rows move to the "no department" ones with the DELETE (see
+analytics.forget_department), the ledger is per employee.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+NAME = "applications_department_id_fkey"
+# See 0007.
+NAMING = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def set_on_delete(on_delete):
+    with op.batch_alter_table("applications", naming_convention=NAMING) as batch:
+        batch.drop_constraint(NAME, type_="foreignkey")
+        batch.create_foreign_key(NAME, "departments", ["department_id"], ["id"], ondelete=on_delete)
+
+
+def upgrade():
+    set_on_delete("SET NULL")
+
+
+def downgrade():
+    set_on_delete("RESTRICT")
@@ -1,12 +1,37 @@
 import enum
 import uuid
 
-from sqlalchemy import Column, Enum, ForeignKey
-from sqlalchemy.dialects.postgresql import BOOLEAN, INTEGER, TIMESTAMP, UUID, VARCHAR
+from sqlalchemy import DDL, JSON, CheckConstraint, Column, Enum, ForeignKey, Index, event, text
+from sqlalchemy.dialects.postgresql import (
+    BOOLEAN,
+    DATE,
+    INTEGER,
+    TIMESTAMP,
+    UUID,
+    VARCHAR,
+    ExcludeConstraint,
+)
 from sqlalchemy.orm import relationship
 
 from db import Base
 
+# pg_trgm backs the trigram GIN indexes used by search.py, btree_gist the
+# WFH exclusion constraint on applications.
+for extension in ("pg_trgm", "btree_gist"):
+    event.listen(
+        Base.metadata,
+        "before_create",
+        DDL(f"CREATE EXTENSION IF NOT EXISTS {extension}").execute_if(dialect="postgresql"),
+    )
+
+
+def trigram_index(name, expression):
+    """GIN trigram index, only emitted on Postgres."""
+    return Index(name, text(f"({expression}) gin_trgm_ops"), postgresql_using="gin").ddl_if(
+        dialect="postgresql"
+    )
+
+
 # from enum import Enum
 
 # from db import Base
@@ -29,15 +54,35 @@ class Application_type(enum.Enum):
     WFH = "WORK FROM HOME"
 
 
+class JobStatus(enum.Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
 class Employee(Base):
     __tablename__ = "employees"
+    __table_args__ = (
+        # Filters of the employee list, with the id as tie breaker for keyset paging.
+        Index("ix_employees_department_id_id", "department_id", "id"),
+        Index("ix_employees_gender_id", "gender", "id"),
+        # Duplicate checks in create_employee / update_employe_by_id.
+        Index("uq_employees_phone_number", "phone_number", unique=True),
+        Index("uq_employees_personal_email_id", "personal_email_id", unique=True),
+        # search.full_name()
+        trigram_index(
+            "ix_employees_full_name_trgm",
+            "coalesce(first_name, '') || ' ' || coalesce(last_name, '')",
+        ),
+    )
 
     id = Column(
         UUID(as_uuid=True),
         primary_key=True,
         default=uuid.uuid4,
     )
-    department_id = Column(UUID(as_uuid=True), ForeignKey("departments.id"))
+    department_id = Column(UUID(as_uuid=True), ForeignKey("departments.id", ondelete="SET NULL"))
     first_name = Column(VARCHAR)
     last_name = Column(VARCHAR)
     dob = Column(TIMESTAMP)
@@ -45,14 +90,27 @@ class Employee(Base):
     phone_number = Column(VARCHAR)
     personal_email_id = Column(VARCHAR)
     is_department_head = Column(BOOLEAN)
-    department = relationship("Department")
-    application = relationship("Application")
+    # Bumped by every UPDATE, the ETag of the row (see updates.py).
+    version = Column(INTEGER, nullable=False, default=1, server_default="1")
+    # Loaded on demand only (``?include=``, see queries.py), never per row.
+    department = relationship("Department", back_populates="employee")
+    # The ON DELETE rules handle the rows of a deleted employee, the session
+    # never loads them for that (passive_deletes).
+    application = relationship("Application", back_populates="employee", passive_deletes=True)
+    languages = relationship(
+        "Language",
+        secondary="employeeslanguages",
+        order_by="Language.name",
+        viewonly=True,
+    )
 
     # application = relationship("Application")
 
 
 class Department(Base):
     __tablename__ = "departments"
+    # Conflict target of the inserts in upserts.py.
+    __table_args__ = (Index("uq_departments_name", "name", unique=True),)
 
     id = Column(
         UUID(as_uuid=True),
@@ -60,18 +118,63 @@ class Department(Base):
         default=uuid.uuid4,
     )
     name = Column(VARCHAR)
-    employee = relationship("Employee")
+    version = Column(INTEGER, nullable=False, default=1, server_default="1")
+    employee = relationship("Employee", back_populates="department", passive_deletes=True)
 
 
 class Application(Base):
     __tablename__ = "applications"
+    __table_args__ = (
+        Index("ix_applications_status_id", "status", "id"),
+        Index("ix_applications_from_date", "from_date"),
+        # One application of a type per employee and start date; also serves
+        # the application_by_employee_id filter.
+        Index(
+            "uq_applications_employee_id_type_from_date",
+            "employee_id",
+            "application_type",
+            "from_date",
+            unique=True,
+        ),
+        trigram_index("ix_applications_reason_trgm", "reason"),
+        # Work from home conflict lookups (applications.insert_application).
+        Index(
+            "ix_applications_department_slot",
+            "department_id",
+            "application_type",
+            "from_date",
+            "to_date",
+        ),
+        # Two live WFH applications of one department can't overlap, enforced
+        # atomically by Postgres whatever the isolation level.
+        ExcludeConstraint(
+            ("department_id", "="),
+            (text("tsrange(from_date, to_date, '[]')"), "&&"),
+            name="ex_applications_wfh_overlap",
+            using="gist",
+            where=text("application_type = 'WFH' AND status <> 'REJECTED'"),
+        ).ddl_if(dialect="postgresql"),
+        # Date range filters and the calendar (periods.py): the period as a
+        # range on Postgres, a to_date first B-tree elsewhere.
+        Index(
+            "ix_applications_period",
+            text("tsrange(from_date, to_date, '[]')"),
+            postgresql_using="gist",
+        ).ddl_if(dialect="postgresql"),
+        Index("ix_applications_to_date_from_date", "to_date", "from_date").ddl_if(
+            dialect="sqlite"
+        ),
+        # The period is a range: tsrange() rejects an inverted one.
+        CheckConstraint("from_date <= to_date", name="ck_applications_period"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
         primary_key=True,
         default=uuid.uuid4,
     )
-    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id"))
+    # Deleting an employee keeps the leave history.
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="SET NULL"))
     application_type = Column(Enum(Application_type))
     from_date = Column(TIMESTAMP)
     to_date = Column(TIMESTAMP)
@@ -80,11 +183,21 @@ class Application(Base):
     status = Column(Enum(Status))
     balance_before_approval = Column(INTEGER)
     balance_after_approval = Column(INTEGER)
-    employee = relationship("Employee")
+    # Department of the employee when applying, copied in by the INSERT. Like
+    # the employees, the applications of a deleted department are left
+    # without one (see analytics.forget_department).
+    department_id = Column(UUID(as_uuid=True), ForeignKey("departments.id", ondelete="SET NULL"))
+    version = Column(INTEGER, nullable=False, default=1, server_default="1")
+    employee = relationship("Employee", back_populates="application")
+    department = relationship("Department")
 
 
 class Language(Base):
     __tablename__ = "languages"
+    __table_args__ = (
+        Index("uq_languages_name", "name", unique=True),
+        trigram_index("ix_languages_name_trgm", "name"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
@@ -92,10 +205,20 @@ class Language(Base):
         default=uuid.uuid4,
     )
     name = Column(VARCHAR)
+    version = Column(INTEGER, nullable=False, default=1, server_default="1")
 
 
 class EmployeeLanguage(Base):
     __tablename__ = "employeeslanguages"
+    __table_args__ = (
+        Index(
+            "uq_employeeslanguages_employee_id_language_id",
+            "employee_id",
+            "language_id",
+            unique=True,
+        ),
+        Index("ix_employeeslanguages_language_id", "language_id"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
@@ -104,9 +227,63 @@ class EmployeeLanguage(Base):
     )
     employee_id = Column(
         UUID(as_uuid=True),
-        ForeignKey("employees.id"),
+        ForeignKey("employees.id", ondelete="CASCADE"),
     )
     language_id = Column(
         UUID(as_uuid=True),
-        ForeignKey("languages.id"),
+        ForeignKey("languages.id", ondelete="CASCADE"),
+    )
+    version = Column(INTEGER, nullable=False, default=1, server_default="1")
+
+
+class LeaveSummary(Base):
+    """Applications and leave days per department, month (of from_date),
+    status and type, maintained incrementally by analytics.py."""
+
+    __tablename__ = "leave_summary"
+
+    # analytics.NO_DEPARTMENT for applications without a department, hence no
+    # foreign key.
+    department_id = Column(UUID(as_uuid=True), primary_key=True)
+    month = Column(DATE, primary_key=True)
+    status = Column(Enum(Status), primary_key=True)
+    application_type = Column(Enum(Application_type), primary_key=True)
+    applications = Column(INTEGER, nullable=False, default=0)
+    days = Column(INTEGER, nullable=False, default=0)
+
+
+class LeaveBalance(Base):
+    """Leave days an employee used per year (of from_date), from the
+    approved leave applications; maintained incrementally by ledger.py."""
+
+    __tablename__ = "leave_balances"
+
+    employee_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("employees.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    year = Column(INTEGER, primary_key=True)
+    used = Column(INTEGER, nullable=False, default=0)
+
+
+class Job(Base):
+    """Background job, run by the dispatcher of jobs.py."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Claim query: due queued jobs, oldest first.
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+        Index("uq_jobs_idempotency_key", "idempotency_key", unique=True),
     )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(VARCHAR, nullable=False)
+    payload = Column(JSON, nullable=False)
+    idempotency_key = Column(VARCHAR)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = Column(INTEGER, nullable=False, default=0)
+    run_after = Column(TIMESTAMP, nullable=False)
+    locked_until = Column(TIMESTAMP)
+    last_error = Column(VARCHAR)
+    created_at = Column(TIMESTAMP, nullable=False)
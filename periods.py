@@ -0,0 +1,119 @@
+"""Date range queries over the applications' periods, ``from_date`` to
+``to_date`` with both days included.
+
+On Postgres the predicates are range operators on
+``tsrange(from_date, to_date, '[]')`` (``&&`` overlaps, ``<@`` contained in,
+``@>`` contains), which the GiST index ix_applications_period serves for
+any date, however many years of history there are. Elsewhere they are
+plain comparisons, served by ix_applications_to_date_from_date: the
+``to_date >= start`` bound skips everything that ended before the range,
+which is most of the table for the recent dates a calendar asks about.
+"""
+
+from sqlalchemy import TIMESTAMP, and_, cast, func, literal, literal_column, select
+
+from applications import as_timestamp
+from db import dialect_name
+from models import Application, Department, Employee, Status
+
+
+def postgres(db):
+    return dialect_name(db) == "postgresql"
+
+
+def inclusive():
+    # Inline, so the expression matches the one of ix_applications_period.
+    return literal_column("'[]'")
+
+
+def period():
+    """The application's period, the expression of ix_applications_period."""
+    return func.tsrange(Application.from_date, Application.to_date, inclusive())
+
+
+def days(start, end):
+    """[start, end] as a range; an open bound for None."""
+    return func.tsrange(as_timestamp(start), as_timestamp(end), inclusive())
+
+
+def overlapping(db, start, end):
+    """Applications with at least one day in [start, end]."""
+    if postgres(db):
+        return period().op("&&")(days(start, end))
+    conditions = []
+    if start is not None:
+        conditions.append(Application.to_date >= as_timestamp(start))
+    if end is not None:
+        conditions.append(Application.from_date <= as_timestamp(end))
+    return and_(*conditions)
+
+
+def within(db, start, end):
+    """Applications with all of their days in [start, end]."""
+    if postgres(db):
+        return period().op("<@")(days(start, end))
+    conditions = []
+    if start is not None:
+        conditions.append(Application.from_date >= as_timestamp(start))
+    if end is not None:
+        conditions.append(Application.to_date <= as_timestamp(end))
+    return and_(*conditions)
+
+
+def covering(db, day):
+    """Applications ``day`` is one of the days of."""
+    if postgres(db):
+        # Typed, ``@>`` also takes a range on its right.
+        return period().op("@>")(cast(literal(as_timestamp(day)), TIMESTAMP))
+    return and_(
+        Application.to_date >= as_timestamp(day), Application.from_date <= as_timestamp(day)
+    )
+
+
+async def out_on(db, day, department_id=None, application_type=None, status=Status.APPROVED):
+    """Employees away on ``day`` (leave or work from home), grouped by
+    department, the department and employee names in order."""
+    query = (
+        select(
+            Application.id,
+            Application.application_type,
+            Application.status,
+            Application.from_date,
+            Application.to_date,
+            Employee.id.label("employee_id"),
+            Employee.first_name,
+            Employee.last_name,
+            Application.department_id,
+            Department.name.label("department"),
+        )
+        .join(Employee, Employee.id == Application.employee_id)
+        .outerjoin(Department, Department.id == Application.department_id)
+        .where(covering(db, day))
+        .order_by(Department.name, Employee.first_name, Employee.last_name, Application.id)
+    )
+    if status:
+        query = query.where(Application.status == status)
+    if application_type:
+        query = query.where(Application.application_type == application_type)
+    if department_id:
+        query = query.where(Application.department_id == department_id)
+
+    departments = {}
+    for row in await db.execute(query):
+        department = departments.setdefault(
+            row.department_id,
+            {"department_id": row.department_id, "department": row.department, "employees": []},
+        )
+        department["employees"].append(
+            {
+                "employee_id": row.employee_id,
+                "first_name": row.first_name,
+                "last_name": row.last_name,
+                "application_id": row.id,
+                "application_type": row.application_type,
+                "status": row.status,
+                "from_date": row.from_date,
+                "to_date": row.to_date,
+            }
+        )
+    return list(departments.values())
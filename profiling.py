@@ -0,0 +1,183 @@
+"""On demand profiling of single requests.
+
+Off unless PROFILE_TOKEN is set. Then a request is profiled when it sends
+``X-Profile: <token>`` (its response carries ``X-Profile-Id``), or when it
+falls in the PROFILE_SAMPLE_RATE share of the traffic. One request is
+profiled at a time per worker, a request arriving meanwhile just isn't.
+
+The profile is a speedscope JSON (https://www.speedscope.app, a flamegraph
+viewer) made by pyinstrument, which samples the coroutine of the request
+only, so the time spent awaiting the database shows up under the await.
+Without pyinstrument installed it is a cProfile dump (``.prof``: snakeviz,
+flameprof, ``python -m pstats``) of everything the event loop ran. Work
+handed to the threadpool (DB_MODE=sync) is not part of either.
+
+Profiles are files in PROFILE_DIR, shared by the workers, the newest
+PROFILE_KEEP of every route are kept. ``GET /profiles/`` lists them and
+``GET /profiles/{profile_id}`` downloads one, both want the token.
+"""
+
+import cProfile
+import marshal
+import os
+import random
+import re
+import secrets
+import time
+import uuid
+
+import anyio
+from fastapi import Header, HTTPException
+
+from metrics import route_label
+from settings import settings
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # pragma: no cover - optional dependency
+    Profiler = None
+
+EXTENSION = ".speedscope.json" if Profiler is not None else ".prof"
+
+# profile file: <started>_<METHOD>_<route slug>_<id><EXTENSION>
+FILE_NAME = re.compile(r"^(\d+)_([A-Z]+)_(.*)_([0-9a-f]{32})\.")
+
+busy = False
+
+
+def authorized(token):
+    return bool(settings.profile_token) and secrets.compare_digest(
+        token or "", settings.profile_token
+    )
+
+
+def require_token(x_profile_token: str = Header(None)):
+    """Dependency of the profile download routes."""
+    if not authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling token required. ")
+
+
+def wanted(scope):
+    if not settings.profile_token:
+        return False
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return authorized(value.decode("latin-1"))
+    return random.random() < settings.profile_sample_rate
+
+
+class RequestProfiler:
+    def __init__(self):
+        if Profiler is not None:
+            self.profiler = Profiler(interval=settings.profile_interval, async_mode="enabled")
+        else:
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if Profiler is not None:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        """The profile, as the bytes of the file."""
+        if Profiler is not None:
+            self.profiler.stop()
+            return self.profiler.output(SpeedscopeRenderer()).encode()
+        self.profiler.disable()
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global busy
+        if scope["type"] != "http" or busy or not wanted(scope):
+            return await self.app(scope, receive, send)
+
+        busy = True
+        profile_id = uuid.uuid4().hex
+        started = time.time()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profiler = RequestProfiler()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            try:
+                data = profiler.stop()
+            finally:
+                busy = False
+            route = slug(route_label(scope))
+            name = f"{int(started * 1000)}_{scope['method']}_{route}_{profile_id}{EXTENSION}"
+            await anyio.to_thread.run_sync(save, name, data)
+
+
+def slug(route):
+    return re.sub(r"[^A-Za-z0-9_]+", "-", route).strip("-") or "root"
+
+
+# ********************************* Storage **********************************
+
+
+def save(file_name, data):
+    os.makedirs(settings.profile_dir, exist_ok=True)
+    with open(os.path.join(settings.profile_dir, file_name), "wb") as profile:
+        profile.write(data)
+    prune(*FILE_NAME.match(file_name).group(2, 3))
+
+
+def prune(method, route):
+    """Keep the newest PROFILE_KEEP profiles of the route."""
+    kept = [
+        profile
+        for profile in stored()
+        if profile["method"] == method and profile["route"] == route
+    ]
+    for profile in kept[settings.profile_keep :]:
+        try:
+            os.remove(os.path.join(settings.profile_dir, profile["file"]))
+        except FileNotFoundError:
+            pass  # another worker got there first
+
+
+def stored():
+    """Profiles on disk, newest first."""
+    try:
+        names = os.listdir(settings.profile_dir)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        match = FILE_NAME.match(name)
+        if match is None:
+            continue
+        started, method, route, profile_id = match.groups()
+        profiles.append(
+            {
+                "id": profile_id,
+                "method": method,
+                "route": route,
+                "started": int(started) / 1000,
+                "file": name,
+            }
+        )
+    return sorted(profiles, key=lambda profile: profile["started"], reverse=True)
+
+
+def find(profile_id):
+    for profile in stored():
+        if profile["id"] == profile_id:
+            return os.path.join(settings.profile_dir, profile["file"])
+    raise HTTPException(status_code=404, detail="Profile not found. ")
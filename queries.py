@@ -0,0 +1,179 @@
+import uuid
+from datetime import date
+
+from fastapi import Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from applications import as_timestamp
+from models import Application, Application_type, Employee, EmployeeLanguage, Gender, Status
+from periods import overlapping, within
+from replicas import get_read_db
+from search import contains
+from validators import ApplicationResponse, EmployeeResponse
+
+# Filter dependencies shared by the list and export routes: each one turns the
+# query parameters into a SELECT the route can page through or stream.
+
+
+def employee_filters(
+    gender: Gender | None = None,
+    email: str | None = None,
+    department_id: uuid.UUID | None = None,
+    search: str | None = None,
+    language_id: uuid.UUID | None = None,
+):
+    query = select(Employee)
+    if gender:
+        query = query.where(Employee.gender == gender)
+    if email:
+        query = query.where(Employee.personal_email_id == email)
+    if search:
+        query = query.where(contains(Employee, search))
+    if department_id:
+        query = query.where(Employee.department_id == department_id)
+    if language_id:
+        query = query.join(EmployeeLanguage, Employee.id == EmployeeLanguage.employee_id).where(
+            EmployeeLanguage.language_id == language_id
+        )
+    return query
+
+
+def application_filters(
+    status: Status | None = None,
+    application_type: Application_type | None = None,
+    from_date: date | None = None,
+    to_date: date | None = None,
+    overlapping_from: date | None = None,
+    overlapping_to: date | None = None,
+    within_from: date | None = None,
+    within_to: date | None = None,
+    starting_after: date | None = None,
+    search: str | None = None,
+    application_by_employee_id: uuid.UUID | None = None,
+    # Read for its backend only, the range filters are written per dialect;
+    # the list route gets the same session (dependencies are cached).
+    db=Depends(get_read_db),
+):
+    for start, end, name in (
+        (overlapping_from, overlapping_to, "overlapping"),
+        (within_from, within_to, "within"),
+    ):
+        if start and end and start > end:
+            raise HTTPException(status_code=400, detail=f"{name}_from is after {name}_to. ")
+    query = select(Application)
+    if status:
+        query = query.where(Application.status == status)
+    if application_type:
+        query = query.where(Application.application_type == application_type)
+    if from_date:
+        query = query.where(Application.from_date == from_date)
+    if to_date:
+        query = query.where(Application.to_date == to_date)
+    # Range filters, index backed (see periods.py).
+    if overlapping_from or overlapping_to:
+        query = query.where(overlapping(db, overlapping_from, overlapping_to))
+    if within_from or within_to:
+        query = query.where(within(db, within_from, within_to))
+    if starting_after:
+        query = query.where(Application.from_date > as_timestamp(starting_after))
+    if search:
+        query = query.where(contains(Application, search))
+    if application_by_employee_id:
+        query = query.where(Application.employee_id == application_by_employee_id)
+    return query
+
+
+# ``?include=`` expansions: name --> relationship. Many-to-one
+# relations are joined into the page query, collections come with one
+# SELECT ... IN per relation, so the statement count doesn't grow with the page.
+
+EMPLOYEE_INCLUDES = {
+    "department": Employee.department,
+    "applications": Employee.application,
+    "languages": Employee.languages,
+}
+
+APPLICATION_INCLUDES = {
+    "employee": Application.employee,
+    "department": Application.department,
+}
+
+
+def comma_list(value, allowed, label):
+    """Names of a ``a,b,c`` query parameter, checked against ``allowed``."""
+    names = [name for name in dict.fromkeys(part.strip() for part in value.split(",")) if name]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown {label} {', '.join(unknown)}, choose from {', '.join(allowed)}. ",
+        )
+    return names
+
+
+class Includes:
+    """Dependency parsing ``?include=a,b`` against the relations of a route."""
+
+    def __init__(self, relations):
+        self.relations = relations
+
+    def __call__(
+        self,
+        include: str | None = Query(
+            None, description="Comma separated related objects to embed in the response."
+        ),
+    ):
+        names = comma_list(include or "", self.relations, "include")
+        return [(name, self.relations[name]) for name in names]
+
+
+class Fields:
+    """Dependency parsing ``?fields=a,b`` (sparse fieldset) against the
+    columns of a response schema. The id always comes along, it is the
+    pagination key; None means every field."""
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def __call__(
+        self,
+        fields: str | None = Query(
+            None, description="Comma separated fields to return (id is always included)."
+        ),
+    ):
+        if not fields:
+            return None
+        names = set(comma_list(fields, self.schema.__fields__, "field"))
+        return tuple(name for name in self.schema.__fields__ if name == "id" or name in names)
+
+
+employee_includes = Includes(EMPLOYEE_INCLUDES)
+application_includes = Includes(APPLICATION_INCLUDES)
+employee_fields = Fields(EmployeeResponse)
+application_fields = Fields(ApplicationResponse)
+
+
+def load_options(includes, model=None, fields=None):
+    """Loader options for the requested includes, and the sparse fieldset."""
+    options = [
+        selectinload(relation) if relation.property.uselist else joinedload(relation)
+        for _, relation in includes
+    ]
+    if fields:
+        options.append(load_only(*(getattr(model, name) for name in fields)))
+    return options
+
+
+def embed(rows, schema, includes, fields=None):
+    """Rows as dicts of the ``schema`` fields (or ``fields``) plus the
+    requested relations (already loaded by load_options); reading an
+    attribute that isn't requested would trigger a lazy load."""
+    fields = fields or list(schema.__fields__)
+    return [
+        {
+            **{field: getattr(row, field) for field in fields},
+            **{name: getattr(row, relation.key) for name, relation in includes},
+        }
+        for row in rows
+    ]
@@ -0,0 +1,207 @@
+"""Read replicas: the reporting reads (the employee and application lists,
+their exports, the calendar, analytics and balances) run on a replica,
+writes and every other read on the primary of db.py.
+
+monitor() measures the lag of every replica each DB_REPLICA_CHECK_SECONDS.
+A replica takes reads while its lag, plus the time since it was measured,
+is at most DB_REPLICA_MAX_LAG; they go round robin over those, and to the
+primary when there is none. A replica losing its connection is left out
+until its next successful check.
+
+Read your writes: a successful write request (any method but GET, HEAD
+and OPTIONS) sets a cookie holding the time until which the reads of that
+client go to the primary, DB_REPLICA_STICKY_SECONDS later.
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import time
+
+import anyio
+from fastapi import Request
+from sqlalchemy import event, text
+
+from db import (
+    DB_MODE,
+    AsyncSessionLocal,
+    SessionLocal,
+    ThreadedSession,
+    make_engine,
+    new_session,
+    pool_status,
+)
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+STICKY_COOKIE = "db_primary_until"
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+LAG_QUERIES = {
+    # 0 while everything received is replayed: an idle primary is no lag.
+    "postgresql": (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() "
+        "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+
+class Replica:
+    def __init__(self, name, url):
+        self.name = name
+        self.engine = make_engine(url, is_async=DB_MODE == "async")
+        self.sync_engine = getattr(self.engine, "sync_engine", self.engine)
+        # Seconds behind the primary, None until checked and while down.
+        self.lag = None
+        self.checked_at = 0.0
+        event.listen(self.sync_engine, "handle_error", self.on_error)
+
+    @property
+    def usable(self):
+        if self.lag is None:
+            return False
+        return self.lag + time.monotonic() - self.checked_at <= settings.db_replica_max_lag
+
+    def on_error(self, context):
+        if context.is_disconnect:
+            self.lag = None
+
+    def session(self):
+        if DB_MODE == "sync":
+            return ThreadedSession(SessionLocal(bind=self.engine))
+        return AsyncSessionLocal(bind=self.engine)
+
+    def lag_query(self):
+        dialect = self.sync_engine.dialect.name
+        return text(settings.db_replica_lag_query or LAG_QUERIES.get(dialect, "SELECT 0"))
+
+    def measure(self):
+        with self.sync_engine.connect() as conn:
+            return conn.scalar(self.lag_query())
+
+    async def check(self):
+        was_usable = self.usable
+        try:
+            if DB_MODE == "sync":
+                lag = await anyio.to_thread.run_sync(self.measure)
+            else:
+                async with self.engine.connect() as conn:
+                    lag = await conn.scalar(self.lag_query())
+        except Exception as error:
+            lag = None
+            if was_usable:
+                log.warning(f"Replica {self.name} is down: {error}")
+        self.lag = None if lag is None else float(lag)
+        self.checked_at = time.monotonic()
+        if was_usable and self.lag is not None and not self.usable:
+            log.warning(f"Replica {self.name} is {self.lag:.1f}s behind, reading from the primary")
+        elif self.usable and not was_usable:
+            log.info(f"Replica {self.name} takes reads")
+
+    def status(self):
+        return {**pool_status(self.engine), "lag": self.lag, "usable": self.usable}
+
+
+# Names only, the URLs may hold passwords.
+replicas = [
+    Replica(f"replica_{number}", url.strip())
+    for number, url in enumerate(settings.db_replica_urls.split(","), 1)
+    if url.strip()
+]
+turns = itertools.count()
+
+
+def pick():
+    """Next usable replica, round robin; None --> read from the primary."""
+    usable = [replica for replica in replicas if replica.usable]
+    if not usable:
+        return None
+    return usable[next(turns) % len(usable)]
+
+
+def sticky(request):
+    """Whether the client wrote less than DB_REPLICA_STICKY_SECONDS ago."""
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_session(primary=False):
+    """Session for a read only handler: on a replica unless ``primary``."""
+    replica = None if primary else pick()
+    return new_session() if replica is None else replica.session()
+
+
+async def get_read_db(request: Request):
+    """get_db() for the reporting routes."""
+    db = read_session(sticky(request))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+def pool_stats():
+    return {replica.name: replica.status() for replica in replicas}
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or not replicas:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                seconds = settings.db_replica_sticky_seconds
+                cookie = (
+                    f"{STICKY_COOKIE}={time.time() + seconds:.3f}; "
+                    f"Max-Age={math.ceil(seconds)}; Path=/; HttpOnly; SameSite=Lax"
+                )
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+# ********************************* Monitor **********************************
+
+
+async def check_all():
+    await asyncio.gather(*(replica.check() for replica in replicas))
+
+
+async def monitor(stopping):
+    while not stopping.is_set():
+        await check_all()
+        try:
+            await asyncio.wait_for(stopping.wait(), settings.db_replica_check_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+checker = None
+stopping = None
+
+
+def start():
+    global checker, stopping
+    if replicas and checker is None:
+        stopping = asyncio.Event()
+        checker = asyncio.create_task(monitor(stopping))
+
+
+async def stop():
+    global checker
+    if checker is not None:
+        stopping.set()
+        await checker
+        checker = None
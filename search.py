@@ -0,0 +1,96 @@
+"""Fuzzy, ranked search over employee names, application reasons and languages.
+
+On Postgres the matching runs on pg_trgm: GIN trigram indexes serve both the
+substring filters (``ILIKE '%q%'`` can't use a B-tree) and the typo tolerant
+``q <% text`` word similarity operator, ranked with ``word_similarity``.
+Other backends (SQLite for local runs) fall back to computing the same
+trigram similarity in Python over the candidate rows.
+"""
+import re
+
+from sqlalchemy import func, literal, literal_column, or_, select
+
+from db import dialect_name
+from models import Application, Employee, Language
+
+# pg_trgm.word_similarity_threshold default, which ``<%`` applies.
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+
+def full_name():
+    # Must stay identical to the expression of ix_employees_full_name_trgm,
+    # constants are rendered inline so the planner can match the index.
+    blank = literal_column("''")
+    return (
+        func.coalesce(Employee.first_name, blank)
+        + literal_column("' '")
+        + func.coalesce(Employee.last_name, blank)
+    )
+
+
+SEARCH_FIELDS = {
+    Employee: full_name,
+    Application: lambda: Application.reason,
+    Language: lambda: Language.name,
+}
+
+
+def contains(model, text):
+    """Case insensitive substring filter, trigram indexed on Postgres."""
+    return SEARCH_FIELDS[model]().ilike(f"%{text}%")
+
+
+def trigrams(text):
+    """pg_trgm's trigrams in text order: lower cased alphanumeric words padded
+    with two leading blanks and one trailing blank."""
+    grams = []
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        padded = f"  {word} "
+        grams.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def word_similarity(query, text):
+    """Python version of pg_trgm's ``word_similarity(query, text)``: the best
+    similarity between the trigrams of ``query`` and any continuous extent of
+    the trigrams of ``text``."""
+    wanted = set(trigrams(query))
+    grams = trigrams(text)
+    if not wanted or not grams:
+        return 0.0
+    best = 0.0
+    for start in range(len(grams)):
+        if grams[start] not in wanted:
+            continue
+        extent = set()
+        # Extents longer than twice the query can only lower the score.
+        for gram in grams[start : start + 2 * len(wanted)]:
+            extent.add(gram)
+            shared = len(wanted & extent)
+            best = max(best, shared / len(wanted | extent))
+    return best
+
+
+async def ranked(db, model, query, limit):
+    """Best ``limit`` rows of ``model`` for ``query`` as ``(row, rank)`` pairs."""
+    field = SEARCH_FIELDS[model]()
+    if dialect_name(db) == "postgresql":
+        rank = func.word_similarity(query, field)
+        statement = (
+            select(model, rank.label("rank"))
+            .where(or_(field.ilike(f"%{query}%"), literal(query).op("<%")(field)))
+            .order_by(rank.desc(), model.id)
+            .limit(limit)
+        )
+        return [(row, float(score)) for row, score in (await db.execute(statement)).all()]
+
+    scored = []
+    for row_id, text in (await db.execute(select(model.id, field))).all():
+        text = text or ""
+        score = 1.0 if query.lower() in text.lower() else word_similarity(query, text)
+        if score >= WORD_SIMILARITY_THRESHOLD:
+            scored.append((score, row_id))
+    scored = sorted(scored, key=lambda item: (-item[0], str(item[1])))[:limit]
+    rows = (await db.scalars(select(model).where(model.id.in_([i for _, i in scored])))).all()
+    by_id = {row.id: row for row in rows}
+    return [(by_id[row_id], score) for score, row_id in scored if row_id in by_id]
@@ -0,0 +1,82 @@
+"""Production server: gunicorn supervising uvicorn workers (uvloop event
+loop, httptools parser) that serve main:app.
+
+    SERVER_WORKERS=4 python -m server
+
+The master imports the app once (preload_app) and forks the workers from
+it, so they start without importing anything and share its memory. After
+the fork every worker opens pools of its own (DB_POOL_SIZE connections per
+engine and worker, mind the server's max_connections) and a log thread of
+its own, then warms up (see warmup.py) before it accepts connections.
+Schema migrations are not run here, see alembic.
+"""
+
+import gc
+import os
+
+from gunicorn.app.base import BaseApplication
+
+import db
+import log_config
+import replicas
+from settings import settings
+
+try:
+    from uvicorn_worker import UvicornWorker
+except ImportError:  # uvicorn < 0.30, or the copy it still ships
+    from uvicorn.workers import UvicornWorker
+
+
+class Worker(UvicornWorker):
+    # Required, not picked when installed; a failing startup (warm up
+    # included) stops the worker instead of serving cold.
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+
+def when_ready(server):
+    # The app is loaded: the objects of the master leave the collector's
+    # reach, collections in the workers won't copy the pages they share.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections are never shared between processes; close=False leaves
+    # any the master opened to the master.
+    for engine in (*db.opened_engines().values(), *(r.engine for r in replicas.replicas)):
+        getattr(engine, "sync_engine", engine).dispose(close=False)
+    log_config.after_fork()
+
+
+def options():
+    return {
+        "bind": settings.server_bind,
+        "workers": settings.server_workers or os.cpu_count() or 1,
+        "worker_class": Worker,
+        "preload_app": True,
+        "timeout": settings.server_timeout,
+        "graceful_timeout": settings.server_graceful_timeout,
+        "keepalive": settings.server_keepalive,
+        "max_requests": settings.server_max_requests,
+        "max_requests_jitter": settings.server_max_requests // 10,
+        "when_ready": when_ready,
+        "post_fork": post_fork,
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        from main import app
+
+        return app
+
+
+if __name__ == "__main__":
+    Server(options()).run()
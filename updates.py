@@ -0,0 +1,116 @@
+"""Single statement PATCH and DELETE: ``UPDATE / DELETE ... WHERE id = :id
+RETURNING ...``.
+
+Every row carries a ``version``, bumped by each UPDATE (single and bulk).
+It is the ETag of the PATCH responses and of ``GET /employee/{id}/`` and
+``GET /application/{id}/``. A PATCH or DELETE sent with
+``If-Match: "<version>"`` only applies while the row still has that version,
+otherwise it is answered 412 and the client re-reads; without the header the
+last write wins, as before.
+
+The row comes back from the same statement, so a PATCH or DELETE is one
+round trip plus the COMMIT. Only one that matched nothing costs a second
+query, to tell a missing row (404) from a stale ``If-Match`` (412). Rows
+referencing a deleted one are handled by the ON DELETE rules of the foreign
+keys (see models.py), nothing is loaded into the session.
+"""
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+
+DEPARTMENT_NOT_FOUND = "Department not found. "
+
+# (names in the error message, answer) per constraint of employees, for
+# violation(). SQLite names the columns of a unique index and no foreign key:
+# the only one of employees is department_id.
+EMPLOYEE_VIOLATIONS = (
+    (("uq_employees_phone_number", "employees.phone_number"), 403, "Phone number already exist. "),
+    (
+        ("uq_employees_personal_email_id", "employees.personal_email_id"),
+        403,
+        "Email id already exist. ",
+    ),
+    (("employees_department_id_fkey", "FOREIGN KEY constraint failed"), 404, DEPARTMENT_NOT_FOUND),
+)
+
+
+def violation(error, rules):
+    """HTTPException of the rule of ``rules`` ((names, status, detail)
+    triples) whose constraint the IntegrityError ``error`` broke; None for
+    any other."""
+    message = str(error.orig)
+    for names, status_code, detail in rules:
+        if any(name in message for name in names):
+            return HTTPException(status_code=status_code, detail=detail)
+    return None
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def expected_version(if_match):
+    """Version asked for by an ``If-Match`` header; None for no precondition."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be an ETag of this API. ")
+
+
+def bump(model):
+    """UPDATE of ``model`` that moves the version on."""
+    return update(model).values(version=model.version + 1)
+
+
+async def update_by_id(db, model, row_id, values, if_match=None, label="Row"):
+    """Apply ``values`` to row ``row_id`` of ``model``; returns the updated row
+    as a dict of all its columns. 404 / 412 when nothing was updated."""
+    version = expected_version(if_match)
+    statement = (
+        bump(model)
+        .where(model.id == row_id)
+        .values(**values)
+        .returning(*model.__table__.c)
+        .execution_options(synchronize_session=False)
+    )
+    if version is not None:
+        statement = statement.where(model.version == version)
+    row = (await db.execute(statement)).first()
+    if row is not None:
+        return dict(row._mapping)
+    await nothing_matched(db, model, row_id, version, label)
+
+
+async def delete_by_id(db, model, row_id, if_match=None, label="Row"):
+    """Delete row ``row_id`` of ``model``; returns it as a dict of all its
+    columns. 404 / 412 when nothing was deleted, 403 while rows of another
+    table still reference it (ON DELETE RESTRICT)."""
+    version = expected_version(if_match)
+    statement = (
+        delete(model)
+        .where(model.id == row_id)
+        .returning(*model.__table__.c)
+        .execution_options(synchronize_session=False)
+    )
+    if version is not None:
+        statement = statement.where(model.version == version)
+    try:
+        row = (await db.execute(statement)).first()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=403, detail=f"{label} is still referenced. ")
+    if row is not None:
+        return dict(row._mapping)
+    await nothing_matched(db, model, row_id, version, label)
+
+
+async def nothing_matched(db, model, row_id, version, label):
+    if version is not None and await db.scalar(select(model.id).where(model.id == row_id)):
+        raise HTTPException(
+            status_code=412, detail=f"{label} was changed meanwhile, fetch it again. "
+        )
+    raise HTTPException(status_code=404, detail=f"{label} not found. ")
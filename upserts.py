@@ -0,0 +1,87 @@
+"""INSERT ... ON CONFLICT for the rows with a natural key: departments and
+languages (name), employee languages (employee, language).
+
+The unique indexes decide, in the same statement as the insert, whether a
+row is new; there is no SELECT first for two requests to race past, and
+nothing is locked when the row already exists (DO NOTHING, no update of
+the existing row).
+"""
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from db import dialect_insert, dialect_name
+from models import Employee, EmployeeLanguage
+
+# model --> columns of its unique key
+KEYS = {EmployeeLanguage: ("employee_id", "language_id")}
+# INSERT / SELECT rounds of ensure() against concurrent deletes.
+ENSURE_ATTEMPTS = 3
+
+
+def natural_key(model):
+    return KEYS.get(model, ("name",))
+
+
+async def insert_new(db, model, values):
+    """Insert one row unless its key is taken; the new row as a dict, None
+    when it already existed. 404 for an unknown foreign key."""
+    statement = (
+        dialect_insert(db, model)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=natural_key(model))
+        .returning(*model.__table__.c)
+    )
+    try:
+        row = (await db.execute(statement)).first()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Employee or language not found. ")
+    return dict(row._mapping) if row is not None else None
+
+
+async def ensure(db, model, values):
+    """The row with the key of ``values``, created if missing; returns
+    ``(row, created)``. An existing row costs a second SELECT, no write; 409
+    when concurrent deletes keep winning the race between the two."""
+    key = [getattr(model, name) == values[name] for name in natural_key(model)]
+    for _ in range(ENSURE_ATTEMPTS):
+        row = await insert_new(db, model, values)
+        if row is not None:
+            return row, True
+        existing = (await db.execute(select(*model.__table__.c).where(*key))).first()
+        if existing is not None:
+            return dict(existing._mapping), False
+        # Deleted between the two statements: insert it after all.
+    raise HTTPException(status_code=409, detail="Changed by a concurrent write, try again. ")
+
+
+async def set_employee_languages(db, employee_id, language_ids):
+    """Make ``language_ids`` the languages of the employee: the other pairs
+    are deleted, the missing ones inserted, the kept ones left alone. One
+    statement on Postgres (the DELETE is a CTE of the INSERT)."""
+    dropped = delete(EmployeeLanguage).where(
+        EmployeeLanguage.employee_id == employee_id,
+        EmployeeLanguage.language_id.not_in(language_ids),
+    )
+    if not language_ids:
+        # Nothing deleted: tell an employee without languages from a missing one.
+        if not (await db.execute(dropped)).rowcount and not await db.get(Employee, employee_id):
+            raise HTTPException(status_code=404, detail="Employee not found. ")
+        return
+
+    statement = (
+        dialect_insert(db, EmployeeLanguage)
+        .values([{"employee_id": employee_id, "language_id": i} for i in language_ids])
+        .on_conflict_do_nothing(index_elements=KEYS[EmployeeLanguage])
+    )
+    try:
+        if dialect_name(db) == "postgresql":
+            await db.execute(statement.add_cte(dropped.cte("dropped")))
+        else:
+            await db.execute(dropped)
+            await db.execute(statement)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Employee or language not found. ")
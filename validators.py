@@ -1,9 +1,11 @@
+import enum
 import uuid
-from datetime import date
+from datetime import date, datetime
+from typing import List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator, validator
 
-from models import Application_type, Gender, Status
+from models import Application_type, Gender, JobStatus, Status
 
 # birth = date.today().strftime("%d-%b-%Y")
 
@@ -36,10 +38,14 @@ class EmployeeResponse(BaseModel):
         orm_mode = True
 
 
+class EmployeeSearchResult(EmployeeResponse):
+    rank: float
+
+
 class EmployeeUpdateRequest(BaseModel):
     first_name: str | None
     last_name: str | None
-    department_id: str | None
+    department_id: uuid.UUID | None
     dob: date | None
     gender: Gender | None
     phone_number: str | None
@@ -50,6 +56,10 @@ class EmployeeUpdateRequest(BaseModel):
         orm_mode = True
 
 
+class EmployeeBulkUpdateRequest(EmployeeUpdateRequest):
+    id: uuid.UUID
+
+
 # ********************* Working on Department table *********************
 
 
@@ -78,16 +88,31 @@ class DepartmentUpdateRequest(BaseModel):
 # *********************** Working on Application Table  ********************
 
 
+def ordered_dates(cls, values):
+    from_date, to_date = values.get("from_date"), values.get("to_date")
+    if from_date is not None and to_date is not None and to_date < from_date:
+        raise ValueError("to_date is before from_date")
+    return values
+
+
 class CreateApplicationRequest(BaseModel):
     application_type: Application_type
-    # employee_id: uuid.UUID | None
+    employee_id: uuid.UUID | None
     from_date: date
     to_date: date
     subject: str
     reason: str
     status: Status
-    balance_before_approval: int
-    balance_after_approval: int
+    # balance_before/after_approval: set from the leave ledger (see ledger.py).
+
+    _ordered_dates = root_validator(allow_reuse=True)(ordered_dates)
+
+    @validator("employee_id", always=True)
+    def employee_for_wfh(cls, employee_id, values):
+        # The work from home rule is per department, the employee's.
+        if employee_id is None and values.get("application_type") == Application_type.WFH:
+            raise ValueError("Work From Home applications need an employee_id")
+        return employee_id
 
     class Config:
         orm_mode = True
@@ -100,8 +125,10 @@ class UpdateApplicationRequest(BaseModel):
     to_date: date | None
     subject: str | None
     reason: str | None
-    balance_before_approval: int | None
-    balance_after_approval: int | None
+    status: Status | None
+    # balance_before/after_approval: set from the leave ledger (see ledger.py).
+
+    _ordered_dates = root_validator(allow_reuse=True)(ordered_dates)
 
     class Config:
         orm_mode = True
@@ -121,6 +148,14 @@ class ApplicationResponse(BaseModel):
         orm_mode = True
 
 
+class ApplicationSearchResult(ApplicationResponse):
+    rank: float
+
+
+class ApplicationBulkUpdateRequest(UpdateApplicationRequest):
+    id: uuid.UUID
+
+
 # ********************** Working on Language Table ************************
 
 
@@ -139,6 +174,10 @@ class LanguageResponse(BaseModel):
         orm_mode = True
 
 
+class LanguageSearchResult(LanguageResponse):
+    rank: float
+
+
 class UpdateLanguage(BaseModel):
     name: str | None
 
@@ -172,3 +211,114 @@ class CreateEmployeeLangaugaes(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+# ********************* Responses with embedded relations ********************
+# Related objects only appear when asked for with ``?include=``, the routes
+# answer with response_model_exclude_unset so the others are left out.
+
+
+class EmployeeDetailResponse(EmployeeResponse):
+    department: DepartmentResponse | None
+    applications: List[ApplicationResponse] | None
+    languages: List[LanguageResponse] | None
+
+
+class ApplicationDetailResponse(ApplicationResponse):
+    employee: EmployeeResponse | None
+    department: DepartmentResponse | None
+
+
+# ******************************** Analytics *********************************
+
+
+class LeaveReportRow(BaseModel):
+    # Only the grouped dimensions are sent.
+    department_id: uuid.UUID | None
+    department: str | None
+    status: Status | None
+    application_type: Application_type | None
+    month: str | None
+    applications: int
+    days: int
+
+
+class LeaveBalanceResponse(BaseModel):
+    employee_id: uuid.UUID
+    first_name: str | None
+    last_name: str | None
+    department_id: uuid.UUID | None
+    year: int
+    allowance: int
+    used: int
+    balance: int
+
+
+class CalendarEntry(BaseModel):
+    employee_id: uuid.UUID
+    first_name: str | None
+    last_name: str | None
+    application_id: uuid.UUID
+    application_type: Application_type
+    status: Status
+    from_date: date
+    to_date: date
+
+
+class CalendarDepartment(BaseModel):
+    department_id: uuid.UUID | None
+    department: str | None
+    employees: List[CalendarEntry]
+
+
+# ********************************* Jobs *************************************
+
+
+class JobRequest(BaseModel):
+    kind: str
+    payload: dict = {}
+
+
+class JobResponse(BaseModel):
+    id: uuid.UUID
+    kind: str
+    payload: dict
+    idempotency_key: str | None
+    status: JobStatus
+    attempts: int
+    run_after: datetime
+    last_error: str | None
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+# ***************************** Bulk operations *****************************
+
+
+class BulkRowStatus(str, enum.Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    INVALID = "invalid"
+    DUPLICATE = "duplicate"
+    CONFLICT = "conflict"
+    NOT_FOUND = "not_found"
+
+
+class BulkRowResult(BaseModel):
+    index: int
+    status: BulkRowStatus
+    id: uuid.UUID | None
+    detail: str | None
+
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkRowResult]
+
+
+class PurgeResponse(BaseModel):
+    deleted: int
@@ -0,0 +1,127 @@
+"""Warm up of a worker, the last startup event of main.py: uvicorn only
+accepts connections once the startup is complete, so the first requests a
+worker serves don't pay for its cold start.
+
+- Pool priming: WARMUP_POOLS opens DB_POOL_SIZE connections of every engine
+  the worker reads and writes through (connect and authentication, the
+  dialect's first connect checks on the first one) and returns them to the
+  pool. Nothing to prime without a client side pool.
+- Replicas: their lag is checked first, without waiting for the monitor,
+  so the reads below go to them as the users' reads will.
+- First requests: every GET of WARMUP_PATHS goes through the app, in
+  process, once per usable replica (round robin, one each) or once on the
+  primary, which compiles their statements into the engines' caches and
+  loads the reference cache. They are left out of the request metrics.
+
+A failing step is logged and the worker starts anyway.
+"""
+
+import asyncio
+import logging
+import time
+
+import anyio
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
+
+import db
+import metrics
+import replicas
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+
+def engines():
+    """The engines the routes use, in this DB_MODE."""
+    yield db.engin if db.async_engin is None else db.async_engin
+    for replica in replicas.replicas:
+        yield replica.engine
+
+
+def connect_all(engine, count):
+    connections = [engine.connect() for _ in range(count)]
+    for connection in connections:
+        connection.close()
+
+
+async def prime(engine):
+    """Fill the pool of ``engine``; returns the connections opened."""
+    is_async = isinstance(engine, AsyncEngine)
+    if not isinstance((engine.sync_engine if is_async else engine).pool, QueuePool):
+        return 0
+    count = settings.db_pool_size
+    if is_async:
+        connections = await asyncio.gather(*(engine.connect() for _ in range(count)))
+        await asyncio.gather(*(connection.close() for connection in connections))
+    else:
+        await anyio.to_thread.run_sync(connect_all, engine, count)
+    return count
+
+
+async def get(app, path):
+    """GET ``path`` from the ASGI ``app``, without a socket; returns the
+    status."""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", b"warmup")],
+        "client": None,
+        "server": None,
+    }
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+    finished = asyncio.Event()
+    status = None
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Streaming responses listen for the disconnect, after the response.
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            finished.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def warm_up(app):
+    started = time.perf_counter()
+    connections = 0
+    if settings.warmup_pools:
+        for engine in engines():
+            try:
+                connections += await prime(engine)
+            except Exception:
+                log.exception("Priming a connection pool failed")
+    await replicas.check_all()
+    rounds = max(sum(replica.usable for replica in replicas.replicas), 1)
+    paths = [path.strip() for path in settings.warmup_paths.split(",") if path.strip()]
+    paths = [path for path in paths for _ in range(rounds)]
+    for path in paths:
+        try:
+            status = await get(app, path)
+        except Exception:
+            log.exception(f"Warm up request {path} failed")
+            continue
+        if status != 200:
+            log.warning(f"Warm up request {path} answered {status}")
+    metrics.reset()
+    log.info(
+        f"Warmed up in {(time.perf_counter() - started) * 1000:.0f} ms: "
+        f"{connections} connections, {len(paths)} requests"
+    )